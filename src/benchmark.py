@@ -0,0 +1,374 @@
+#!/usr/bin/fades
+"""Benchmarks every stage with synthetic inputs.
+
+The inputs are generated in a work folder: VTT files with rolling captions,
+slide Markdown files and pptx templates with many layouts. Each case runs in
+a fresh process, so its peak memory is its own, and the best time of
+`--repeat` runs is kept. The LLM stage is run against `fake_llm_server`, so
+it works offline and measures the client side only.
+
+The results are saved as JSON, and `--compare` shows the speed up against a
+previous results file.
+"""
+
+import argparse
+import configparser
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from fake_llm_server import slides_markdown
+
+# Sizes of the cases of each stage
+SIZES = dict(
+    clean_vtt=[1_000, 10_000, 100_000],
+    md2json=[100, 1_000, 10_000],
+    template=[11, 50, 200],
+    fitting=[11, 50, 200],
+    render=[50, 200, 1_000],
+    llm=[1, 8, 32],
+)
+QUICK_SIZES = dict(
+    clean_vtt=[1_000],
+    md2json=[100],
+    template=[11],
+    fitting=[11],
+    render=[20],
+    llm=[4],
+)
+# Layouts of the template used to render, slides fitted per case, and the
+# slides and latency of each fake LLM answer
+RENDER_LAYOUTS = 50
+FITTED_SLIDES = 10_000
+LLM_SLIDES = 25
+LLM_LATENCY = 0.05
+LLM_CONCURRENCY = 8
+
+
+def make_vtt(path, cues):
+    """Writes a VTT file with the rolling captions of YouTube."""
+    words = slides_markdown(1).split()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("WEBVTT\nKind: captions\nLanguage: en\n\n")
+        previous = ""
+        for n in range(cues):
+            start, end = n * 2.0, n * 2.0 + 2.0
+            line = " ".join(words[(n + i) % len(words)] for i in range(6))
+            timed = "".join(
+                f"<{time_stamp(start + i * 0.3)}><c> {word}</c>"
+                for i, word in enumerate(line.split()[1:])
+            )
+            f.write(
+                f"{time_stamp(start)} --> {time_stamp(end)} align:start position:0%\n"
+                f"{previous}\n{line.split()[0]}{timed}\n\n"
+                f"{time_stamp(end)} --> {time_stamp(end + 0.01)} align:start position:0%\n"
+                f"{line}\n \n\n"
+            )
+            previous = line
+
+
+def time_stamp(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+
+
+def make_template(path, layouts):
+    """Writes a template with `layouts` layouts, cycling the default ones."""
+    from pptx import Presentation  # fades python-pptx
+    from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+    from pptx.opc.packuri import PackURI
+    from pptx.parts.slide import SlideLayoutPart
+
+    prs = Presentation()
+    master = prs.slide_master
+    originals = list(master.slide_layouts)
+    id_list = master._element.get_or_add_sldLayoutIdLst()
+    next_id = max(int(layout_id.get("id")) for layout_id in id_list) + 1
+    for n in range(len(originals), layouts):
+        source = originals[n % len(originals)].part
+        part = SlideLayoutPart.load(
+            PackURI(f"/ppt/slideLayouts/slideLayout{n + 1}.xml"),
+            source.content_type,
+            prs.part.package,
+            source.blob,
+        )
+        part.relate_to(master.part, RT.SLIDE_MASTER)
+        id_list._add_sldLayoutId(
+            id=next_id, rId=master.part.relate_to(part, RT.SLIDE_LAYOUT)
+        )
+        next_id += 1
+    prs.save(path)
+
+
+def make_slides(count, seed=0):
+    """Returns slides with random sets of fields, as md2json gives them."""
+    rnd = random.Random(seed)
+    slides = []
+    for n in range(count):
+        slide = dict(title=[f"Slide {n}"], content=[], notes=[], visual=[])
+        if rnd.random() < 0.8:
+            slide["content"] = [f"- point {i}" for i in range(rnd.randint(1, 5))]
+        if rnd.random() < 0.2:
+            slide["title"] = []
+        if rnd.random() < 0.5:
+            slide["notes"] = ["say something"]
+        slides.append(slide)
+    return slides
+
+
+def prepare(stage, size, workdir):
+    """Writes the input of a case, unless it is already there."""
+    inputs = dict(
+        clean_vtt=workdir / f"captions-{size}.vtt",
+        md2json=workdir / f"slides-{size}.md",
+        template=workdir / f"template-{size}.pptx",
+        fitting=workdir / f"template-{size}.pptx",
+        render=workdir / f"template-{RENDER_LAYOUTS}.pptx",
+        llm=workdir / "transcript.txt",
+    )
+    path = inputs[stage]
+    if not path.exists():
+        if stage == "clean_vtt":
+            make_vtt(path, size)
+        elif stage == "md2json":
+            path.write_text(slides_markdown(size), encoding="utf-8")
+        elif stage in ("template", "fitting"):
+            make_template(path, size)
+        elif stage == "render":
+            make_template(path, RENDER_LAYOUTS)
+        elif stage == "llm":
+            path.write_text(slides_markdown(20), encoding="utf-8")
+    return path
+
+
+@contextlib.contextmanager
+def fake_llm():
+    """Serves the fake LLM while in use, yields the config pointing to it."""
+    from fake_llm_server import start_server
+
+    server, url = start_server(slides=LLM_SLIDES, latency=LLM_LATENCY)
+    config = configparser.ConfigParser()
+    config.read_dict(dict(AI_SERVICE=dict(api_key="x", api_base=url, model_name="m")))
+    try:
+        yield config
+    finally:
+        server.shutdown()
+
+
+def run_stage(stage, size, path, workdir, config=None):
+    """Runs the stage once, returns the items it processed by kind."""
+    if stage == "clean_vtt":
+        import clean_vtt
+
+        lines = sum(1 for _ in clean_vtt.clean_transcript(path))
+        return dict(transcript_lines=lines)
+    if stage == "md2json":
+        import md2json
+
+        slides = sum(1 for _ in md2json.parse_markdown(path))
+        return dict(slides=slides)
+    if stage == "template":
+        from process_template import Layouts
+
+        Layouts(path)
+        return dict(templates=1, layouts=size)
+    if stage == "fitting":
+        from process_template import Layouts
+
+        layouts = Layouts(path)
+        for slide in make_slides(FITTED_SLIDES):
+            layouts.get_fitted_layouts(slide)[0].get_fitting(slide)
+        return dict(slides=FITTED_SLIDES)
+    if stage == "render":
+        from create_w_template import build_presentation
+
+        build_presentation(str(path), make_slides(size), workdir / "render.pptx")
+        return dict(decks=1, slides=size)
+    if stage == "llm":
+        return run_llm(size, path, workdir, config)
+
+
+def run_llm(units, transcript, workdir, config):
+    """Generates `units` units in batch mode against the fake LLM."""
+    import asyncio
+
+    import create_slides_ia
+
+    plan = workdir / "unit_plan.txt"
+    plan.write_text("Food and drinks", encoding="utf-8")
+    manifest = [
+        dict(file=transcript, unit_plan=plan, output=workdir / f"llm-{n}.md")
+        for n in range(units)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        failed = asyncio.run(
+            create_slides_ia.run_batch(
+                manifest, create_slides_ia.DEFAULT_TEMPLATES, config, LLM_CONCURRENCY
+            )
+        )
+    if failed:
+        raise RuntimeError(f"{failed} units failed")
+    return dict(requests=units, slides=units * LLM_SLIDES)
+
+
+# Modules imported before the timing, so it does not include their import
+STAGE_MODULES = dict(
+    clean_vtt=["clean_vtt"],
+    md2json=["md2json"],
+    template=["process_template", "pptx"],
+    fitting=["process_template", "pptx"],
+    render=["create_w_template", "pptx"],
+    llm=["create_slides_ia", "openai", "asyncio"],
+)
+
+
+def run_case(stage, size, path, workdir, repeat):
+    """Runs a case in its own process, returns its best time and memory."""
+    import importlib
+    import resource
+
+    for module in STAGE_MODULES[stage]:
+        importlib.import_module(module)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = None
+    with fake_llm() if stage == "llm" else contextlib.nullcontext() as config:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            counts = run_stage(stage, size, path, workdir, config)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if stage in ("clean_vtt", "md2json"):
+        with open(path, "rb") as f:
+            counts = dict(lines=sum(1 for _ in f), **counts)
+    return dict(
+        stage=stage,
+        size=size,
+        seconds=round(best, 6),
+        throughput={f"{kind}/s": round(n / best, 2) for kind, n in counts.items()},
+        peak_mb=round(peak / 1024, 1),
+        baseline_mb=round(baseline / 1024, 1),
+    )
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(results, old_path):
+    """Prints the speed up of each case against an older results file."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = {(c["stage"], c["size"]): c for c in json.load(f)["cases"]}
+    for case in results["cases"]:
+        before = old.get((case["stage"], case["size"]))
+        if before is None:
+            continue
+        print(
+            f"{case['stage']:10} {case['size']:>8}  "
+            f"{before['seconds'] / case['seconds']:6.2f}x  "
+            f"memory {case['peak_mb'] - before['peak_mb']:+.1f} MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the stages with synthetic inputs."
+    )
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        help=f"Stages to run, of {', '.join(SIZES)} (default: all of them).",
+    )
+    parser.add_argument(
+        "--quick", "-q", action="store_true", help="Only the smallest cases."
+    )
+    parser.add_argument(
+        "--repeat", "-r", type=int, default=3, help="Runs per case (default: 3)."
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=Path("benchmark.json"),
+        help="Results file (default: benchmark.json).",
+    )
+    parser.add_argument(
+        "--workdir",
+        "-w",
+        type=Path,
+        help="Folder of the generated inputs, kept between runs "
+        "(default: a temporary folder).",
+    )
+    parser.add_argument(
+        "--compare", "-c", type=Path, help="Compare with a previous results file."
+    )
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    stages = args.stages or list(SIZES)
+    unknown = set(stages) - set(SIZES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    with contextlib.ExitStack() as stack:
+        if args.workdir:
+            workdir = args.workdir.resolve()
+            workdir.mkdir(parents=True, exist_ok=True)
+        else:
+            workdir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        # The caches of the stages are kept in the work folder
+        os.environ["SLIDES_CACHE_DIR"] = str(workdir / "cache")
+
+        results = dict(
+            date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            commit=git_commit(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            repeat=args.repeat,
+            cases=[],
+        )
+        for stage in stages:
+            for size in sizes[stage]:
+                path = prepare(stage, size, workdir)
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    case = pool.submit(
+                        run_case, stage, size, path, workdir, args.repeat
+                    ).result()
+                results["cases"].append(case)
+                throughput = ", ".join(
+                    f"{n:,.0f} {kind}" if n >= 100 else f"{n:.2f} {kind}"
+                    for kind, n in case["throughput"].items()
+                )
+                print(
+                    f"{stage:10} {size:>8}  {case['seconds']:8.3f}s  "
+                    f"{throughput}  peak {case['peak_mb']} MB"
+                )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
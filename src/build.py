@@ -0,0 +1,398 @@
+#!/usr/bin/fades
+"""Incremental build of the presentations of a whole course.
+
+Each unit goes through the nodes VTT -> transcript -> slides.md ->
+slides.json -> pptx -> odp. A node is keyed by a hash of everything that
+produces it: the content of its inputs, the code of its stage, and the
+prompts, model or template it uses. Only the nodes whose key changed, or
+whose output is missing, are built again, and the units are built in
+parallel. The odp files are converted by warm office processes shared by
+all the units.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+import clean_vtt
+import create_slides_ia
+import instrument
+import llm_routes
+import md2json
+from create_w_template import create_presentation, output
+from disk_cache import file_hash
+from office_convert import Converter
+
+SRC_DIR = Path(__file__).resolve().parent
+STATE_FILE = ".build-state.json"
+NODES = ("transcript", "slides_md", "slides_json", "pptx", "odp")
+# Source files whose code produces each node
+NODE_CODE = dict(
+    transcript=["clean_vtt.py"],
+    slides_md=["create_slides_ia.py", "llm_routes.py", "transcript_chunks.py"],
+    slides_json=["md2json.py"],
+    pptx=[
+        "create_w_template.py",
+        "process_template.py",
+        "image_cache.py",
+        "md2json.py",
+    ],
+    odp=["office_convert.py"],
+)
+# Response cache of the process, shared by the units it builds
+_cache = None
+
+
+@dataclass
+class Unit:
+    name: str
+    vtt: Path
+    unit_plan: Path
+
+    def outputs(self, work, results):
+        return dict(
+            transcript=work / f"{self.name}-transcript.txt",
+            slides_md=work / f"{self.name}-slides.md",
+            slides_json=work / f"{self.name}-slides.json",
+            pptx=work / f"{self.name}-slides.pptx",
+            odp=results / f"{self.name}-slides.odp",
+        )
+
+
+@lru_cache
+def code_version(node):
+    return tuple(file_hash(SRC_DIR / name) for name in NODE_CODE[node])
+
+
+def node_key(node, *parts):
+    data = json.dumps([node, *code_version(node), *parts], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def pictures_hash(slides_json):
+    """Hashes of the pictures the slides embed, None for the missing ones."""
+    with open(slides_json, "r", encoding="utf-8") as f:
+        slides = json.load(f)
+    # Only the first visual of a slide is embedded
+    names = sorted({slide["visual"][0] for slide in slides if slide.get("visual")})
+    return [(name, file_hash(name) if Path(name).is_file() else None) for name in names]
+
+
+def open_cache(enabled=True):
+    """Opens the response cache of a build process, once."""
+    global _cache
+    _cache = create_slides_ia.ResponseCache() if enabled else None
+
+
+def find_units(input_dir, pattern, unit_plan):
+    """Finds the VTT files of the units and their unit plans.
+
+    The unit number is the first group of `pattern` in the VTT file name,
+    and the unit plan name is `unit_plan` formatted with that number.
+    """
+    regex = re.compile(pattern)
+    units = []
+    for vtt in sorted(Path(input_dir).glob("*.vtt")):
+        match = regex.search(vtt.name)
+        if not match:
+            continue
+        number = match.group(1)
+        units.append(
+            Unit(
+                name=f"u{number}",
+                vtt=vtt,
+                unit_plan=Path(input_dir) / unit_plan.format(number),
+            )
+        )
+    return units
+
+
+def load_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    tmp = Path(path).with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def build_unit(unit, template, work, results, state, dry_run=False, refresh=False):
+    """Builds the stale nodes of a unit, up to its pptx.
+
+    Returns the new state keys of its outputs, the built nodes with the
+    seconds spent on each, and the error that stopped the build, if any. With `dry_run`, nothing is built and the nodes
+    that would be built are returned, with 0 seconds. The responses of the
+    model are cached in the cache opened by `open_cache`, unless `refresh`.
+    """
+    config = create_slides_ia.initialize_config()
+    templates = create_slides_ia.load_prompt_templates()
+    outputs = unit.outputs(work, results)
+    nodes = NODES[:-1]
+    keys = {}
+    built = {}
+    stale = False
+
+    def inputs_hash(node):
+        """Hashes of the inputs of the node, None when an input is stale."""
+        if node == "transcript":
+            return [file_hash(unit.vtt)]
+        previous = outputs[NODES[NODES.index(node) - 1]]
+        if stale or not previous.exists():
+            return None
+        extra = []
+        if node == "slides_md":
+            extra = [
+                file_hash(unit.unit_plan),
+                templates.get("create_slides"),
+                templates.get("summarize_chunk"),
+                config["AI_SERVICE"]["model_name"],
+                *llm_routes.route_models(config),
+            ]
+        elif node == "pptx":
+            extra = [file_hash(template), pictures_hash(previous)]
+        return [file_hash(previous)] + extra
+
+    for node in nodes:
+        out = outputs[node]
+        inputs = inputs_hash(node)
+        key = node_key(node, inputs) if inputs is not None else None
+        if key is not None and out.exists() and state.get(str(out)) == key:
+            continue
+        stale = True
+        if dry_run:
+            built[node] = 0.0
+            continue
+
+        start = time.perf_counter()
+        try:
+            with instrument.span("build_node", unit=unit.name, node=node):
+                if node == "transcript":
+                    with instrument.span("vtt_parse", input=str(unit.vtt)):
+                        transcript = "\n".join(clean_vtt.clean_transcript(unit.vtt))
+                    create_slides_ia.write_file(out, transcript + "\n")
+                elif node == "slides_md":
+                    unit_plan = create_slides_ia.read_file(unit.unit_plan)
+                    transcription = create_slides_ia.condense_transcription(
+                        create_slides_ia.read_file(outputs["transcript"]),
+                        unit_plan,
+                        templates,
+                        config,
+                        cache=_cache,
+                        refresh=refresh,
+                    )
+                    prompt = create_slides_ia.build_prompt(
+                        templates, unit_plan, transcription
+                    )
+                    create_slides_ia.write_file(
+                        out,
+                        create_slides_ia.generate_chat_completion(
+                            prompt, config, _cache, refresh
+                        ),
+                    )
+                elif node == "slides_json":
+                    with instrument.span("md_parse", output=str(out)):
+                        slides_data = list(md2json.parse_markdown(outputs["slides_md"]))
+                    with out.open("w") as f:
+                        json.dump(slides_data, f, indent=4)
+                elif node == "pptx":
+                    create_presentation(str(template), outputs["slides_json"], str(out))
+        except Exception as e:
+            # The nodes built so far keep their keys, to not build them again
+            return keys, built, e
+        built[node] = time.perf_counter() - start
+        # The key is computed again, now that the inputs are built
+        stale = False
+        keys[str(out)] = node_key(node, inputs_hash(node))
+    return keys, built, None
+
+
+def odp_key(unit, work, results, state):
+    """Returns the key of the odp of a unit, None when it is up to date."""
+    outputs = unit.outputs(work, results)
+    key = node_key("odp", [file_hash(outputs["pptx"])])
+    if outputs["odp"].exists() and state.get(str(outputs["odp"])) == key:
+        return None
+    return key
+
+
+def convert_unit(converter, unit, work, results):
+    """Converts the pptx of a unit to odp, returns the seconds spent."""
+    outputs = unit.outputs(work, results)
+    start = time.perf_counter()
+    converter.convert(outputs["pptx"], outputs["odp"].parent)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds the presentations of the units that are out of date."
+    )
+    parser.add_argument(
+        "template", type=Path, help="Path to the pptx template of the course."
+    )
+    parser.add_argument(
+        "--input", "-i", type=Path, default=Path("input"), help="Input folder."
+    )
+    parser.add_argument(
+        "--work", "-w", type=Path, default=Path("work"), help="Work folder."
+    )
+    parser.add_argument(
+        "--results", "-r", type=Path, default=Path("results"), help="Results folder."
+    )
+    parser.add_argument(
+        "--pattern",
+        default=r"UNIT (\d+)",
+        help=r"Regex whose first group is the unit number in the VTT names "
+        r"(default: 'UNIT (\d+)').",
+    )
+    parser.add_argument(
+        "--unit-plan",
+        default="u{}-unit_plan.txt",
+        help="Name of the unit plans in the input folder (default: u{}-unit_plan.txt).",
+    )
+    parser.add_argument(
+        "--units", nargs="*", help="Only build these units, like u3 u12."
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None, help="Units built in parallel."
+    )
+    parser.add_argument("--no-odp", action="store_true", help="Do not convert to odp.")
+    parser.add_argument(
+        "--converters",
+        type=int,
+        default=2,
+        help="Warm office processes converting to odp (default: 2).",
+    )
+    parser.add_argument(
+        "--dry-run", "-n", action="store_true", help="Only show what would be built."
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the local cache of responses.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ask the model again and update the cached responses.",
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    template = args.template.expanduser().resolve()
+    if not template.exists():
+        sys.exit(f"Template file not found: {args.template}")
+    create_slides_ia.initialize_config()
+    create_slides_ia.check_prompt_templates()
+    units = find_units(args.input, args.pattern, args.unit_plan)
+    if args.units:
+        units = [unit for unit in units if unit.name in args.units]
+    missing = [str(unit.unit_plan) for unit in units if not unit.unit_plan.exists()]
+    if missing:
+        sys.exit(f"Unit plans not found: {', '.join(missing)}")
+
+    args.work.mkdir(parents=True, exist_ok=True)
+    args.results.mkdir(parents=True, exist_ok=True)
+    state_path = args.work / STATE_FILE
+    state = load_state(state_path)
+
+    from concurrent.futures import (
+        ProcessPoolExecutor,
+        ThreadPoolExecutor,
+        as_completed,
+    )
+
+    failed = 0
+    converter = None
+    conversions = {}
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=open_cache,
+            initargs=(not args.no_cache and not args.dry_run,),
+        ) as pool, ThreadPoolExecutor(max_workers=args.converters) as convert_pool:
+            futures = {
+                pool.submit(
+                    build_unit,
+                    unit,
+                    template,
+                    args.work,
+                    args.results,
+                    state,
+                    args.dry_run,
+                    args.refresh,
+                ): unit
+                for unit in units
+            }
+            for future in as_completed(futures):
+                unit = futures[future]
+                try:
+                    keys, built, error = future.result()
+                except Exception as e:
+                    keys, built, error = {}, {}, e
+                if not args.dry_run and keys:
+                    state.update(keys)
+                    save_state(state_path, state)
+                if error is not None:
+                    failed += 1
+                    output(f"{unit.name}: failed, {error}")
+                    continue
+                if built:
+                    steps = ", ".join(f"{node} {t:.1f}s" for node, t in built.items())
+                    output(f"{unit.name}: {steps}")
+                elif args.no_odp:
+                    output(f"{unit.name}: up to date")
+                if args.no_odp:
+                    continue
+
+                if args.dry_run:
+                    if built or odp_key(unit, args.work, args.results, state):
+                        output(f"{unit.name}: odp")
+                    continue
+                key = odp_key(unit, args.work, args.results, state)
+                if key is None:
+                    if not built:
+                        output(f"{unit.name}: up to date")
+                    continue
+                if converter is None:
+                    # Started on the first conversion, up to date builds skip it
+                    converter = Converter(args.converters)
+                conversion = convert_pool.submit(
+                    convert_unit, converter, unit, args.work, args.results
+                )
+                conversions[conversion] = unit, key
+
+            for conversion in as_completed(conversions):
+                unit, key = conversions[conversion]
+                try:
+                    seconds = conversion.result()
+                except Exception as e:
+                    failed += 1
+                    output(f"{unit.name}: odp failed, {e}")
+                    continue
+                state[str(unit.outputs(args.work, args.results)["odp"])] = key
+                save_state(state_path, state)
+                output(f"{unit.name}: odp {seconds:.1f}s")
+    finally:
+        if converter is not None:
+            converter.close()
+    if failed:
+        sys.exit(f"{failed} of {len(units)} units failed")
+
+
+if __name__ == "__main__":
+    main()
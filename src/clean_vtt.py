@@ -1,56 +1,428 @@
 import argparse
+import glob
+import json
+import mmap
 import re
 import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
 from pathlib import Path
 
+import instrument
 
-def filter_lines(input_file):
-    with input_file.open("r") as f:
-        before = ""
-        for line in f.readlines():
-            line = line.strip()
-            if not line:
-                continue
-            elif " --> " in line:
-                continue
-            elif line == before:
-                continue
+TAG = re.compile(r"<[^>]+>")
+# The word timings of auto generated, rolling, captions: <00:00:01.500><c>
+WORD_TIMING = re.compile(r"<(?:\d|c[.>])")
+TIME = r"((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})"
+TIMING = re.compile(TIME + r"\s+-->\s+" + TIME)
+# Words remembered to find the text repeated by rolling captions
+WINDOW = 64
+
+
+@dataclass
+class Cue:
+    # Timestamps as written in the file, converted only when needed
+    start: str
+    end: str
+    text: str
+    # A cue of rolling captions, with word timings or a line of blank space
+    rolling: bool = False
+
+    @property
+    def start_seconds(self):
+        return parse_time(self.start)
+
+    @property
+    def end_seconds(self):
+        return parse_time(self.end)
+
+
+def parse_time(value):
+    """Converts a VTT timestamp, like 01:02:03.456 or 02:03.456, to seconds."""
+    *hours, minutes, seconds = value.split(":")
+    total = int(minutes) * 60 + float(seconds.replace(",", "."))
+    if hours:
+        total += int(hours[0]) * 3600
+    return round(total, 3)
+
+
+def clean_text(text):
+    "Replace the HTML tags and collapse the spaces."
+    if "<" in text:
+        text = TAG.sub(" ", text)
+    return " ".join(text.split())
+
+
+def read_cues(input_file):
+    """Yields the cues of a VTT file, reading it line by line.
+
+    The header, NOTE and STYLE blocks and the cue identifiers are skipped.
+    Raises ValueError if the file does not start with WEBVTT.
+    """
+
+    def cue(timing, text):
+        rolling = any(WORD_TIMING.search(line) or not line.strip() for line in text)
+        lines = [line for line in map(clean_text, text) if line]
+        return Cue(*timing, " ".join(lines), rolling)
+
+    with input_file.open("r", encoding="utf-8-sig") as f:
+        first = f.readline().strip()
+        if not first.startswith("WEBVTT"):
+            raise ValueError(f"Input file {input_file} is not a vtt file {first}")
+        timing = None
+        text = []
+        for line in f:
+            # Only an empty line ends a cue, rolling captions use lines
+            # with a single space as cue text
+            if line == "\n":
+                if timing is not None:
+                    yield cue(timing, text)
+                timing = None
+                text = []
+            elif timing is None:
+                match = TIMING.search(line)
+                if match:
+                    timing = match.groups()
             else:
-                yield line
-                before = line
+                text.append(line)
+        if timing is not None:
+            yield cue(timing, text)
+
+
+def overlap_size(recent, words):
+    """Returns how many leading words are the last words already seen."""
+    size = len(recent)
+    start = max(0, size - len(words))
+    while True:
+        # Only the positions holding the first word can start an overlap
+        try:
+            start = recent.index(words[0], start)
+        except ValueError:
+            return 0
+        if recent[start:] == words[: size - start]:
+            return size - start
+        start += 1
+
+
+def dedup_cues(cues, window=WINDOW):
+    """Removes the text that each cue repeats from the previous ones.
+
+    Auto generated captions show every line in several rolling cues; only the
+    words after the longest overlap with the last `window` words are kept,
+    and cues left without new words are dropped. Only the rolling cues, and
+    those that start before the previous one ends, are trimmed, so plain
+    captions keep their words:
+
+    >>> [c.text for c in dedup_cues([Cue("00:00.000", "00:02.000", "I went to the"),
+    ...     Cue("00:02.000", "00:04.000", "the store yesterday. Yes."),
+    ...     Cue("00:04.000", "00:05.000", "Yes.")])]
+    ['I went to the', 'the store yesterday. Yes.', 'Yes.']
+    """
+    recent = []
+    previous = None
+    for cue in cues:
+        words = cue.text.split()
+        if not words:
+            continue
+        if (
+            cue.rolling
+            or previous is not None
+            and cue.start_seconds < previous.end_seconds
+        ):
+            overlap = overlap_size(recent, words)
+        else:
+            overlap = 0
+        previous = cue
+        if overlap == len(words):
+            continue
+        if overlap:
+            cue = Cue(cue.start, cue.end, " ".join(words[overlap:]), cue.rolling)
+        recent.extend(words[overlap:])
+        if len(recent) > 2 * window:
+            del recent[:-window]
+        yield cue
+
+
+def process_lines(input_file, window=WINDOW):
+    "Yields the new text of each cue, with the tags and repetitions removed."
+    for cue in dedup_cues(read_cues(input_file), window):
+        yield cue.text
+
+
+def clean_transcript(input_file):
+    """Yields the transcript lines of a VTT file, without its preamble.
+
+    Raises ValueError if the file is not a VTT file.
+    """
+    yield from process_lines(input_file)
+
+
+def index_path(jsonl_file):
+    return Path(jsonl_file).with_suffix(Path(jsonl_file).suffix + ".idx")
+
+
+def write_timed(cues, jsonl_file):
+    """Writes the cues as JSON Lines, with their times, and yields their text.
+
+    A sidecar `.idx` file gets the start, end and file offset of each cue as
+    a flat array of doubles, which `TranscriptIndex` loads to find a time
+    range without reading the whole transcript. Both files are written as
+    temporary files, and only replace the old ones once all the cues are read.
+    """
+    index = array("d")
+    offset = 0
+    tmp = Path(jsonl_file).with_suffix(Path(jsonl_file).suffix + ".tmp")
+    index_tmp = index_path(jsonl_file).with_suffix(".idx.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            for cue in cues:
+                start, end = cue.start_seconds, cue.end_seconds
+                data = json.dumps(dict(start=start, end=end, text=cue.text))
+                data = data.encode("utf-8") + b"\n"
+                index.extend((start, end, offset))
+                f.write(data)
+                offset += len(data)
+                yield cue.text
+        with open(index_tmp, "wb") as f:
+            index.tofile(f)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        index_tmp.unlink(missing_ok=True)
+        raise
+    tmp.replace(jsonl_file)
+    index_tmp.replace(index_path(jsonl_file))
+
+
+class TranscriptIndex:
+    """Reads the cues of a time range from a `write_timed` transcript."""
+
+    def __init__(self, jsonl_file):
+        index = array("d")
+        with open(index_path(jsonl_file), "rb") as f:
+            index.frombytes(f.read())
+        self.starts = index[0::3]
+        self.ends = index[1::3]
+        self.offsets = index[2::3]
+        self._file = open(jsonl_file, "rb")
+        self._map = None
+        if self.offsets:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets)
 
+    def __enter__(self):
+        return self
 
-def process_lines(input_file):
-    "Replace some HTML tags and remove empty lines."
-    before = ""
-    for line in filter_lines(input_file):
-        plain_text = re.sub("<[^>]+>", " ", line)
-        plain_text = re.sub(" +", " ", plain_text)
-        plain_text = plain_text.strip()
-        if plain_text != before:
-            yield plain_text
-            before = plain_text
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def cue(self, position):
+        """Returns the cue as a dict with its start, end and text."""
+        start = int(self.offsets[position])
+        end = self._map.find(b"\n", start)
+        return json.loads(self._map[start:end])
+
+    def span(self, start, end):
+        """Returns the cues shown between start and end, in seconds."""
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        return [self.cue(position) for position in range(first, last)]
+
+    def text(self, start, end):
+        """Returns the transcript between start and end, in seconds."""
+        return " ".join(cue["text"] for cue in self.span(start, end))
+
+
+def clean_file(input_file, output_file, jsonl_file=None):
+    """Writes the transcript of a VTT file, and its timed cues if asked.
+
+    Returns the seconds spent and the sizes of the input and output files.
+    """
+    start = time.perf_counter()
+    tmp = output_file.with_suffix(output_file.suffix + ".tmp")
+    if jsonl_file is None:
+        lines = clean_transcript(input_file)
+    else:
+        lines = write_timed(dedup_cues(read_cues(input_file)), jsonl_file)
+    try:
+        with instrument.span("vtt_parse", input=str(input_file)), tmp.open(
+            "w", encoding="utf-8"
+        ) as f:
+            f.writelines(line + "\n" for line in lines)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    tmp.replace(output_file)
+    return (
+        time.perf_counter() - start,
+        input_file.stat().st_size,
+        output_file.stat().st_size,
+    )
+
+
+def batch_outputs(input_files, output_dir, pattern, name):
+    """Maps each VTT file to its transcript file.
+
+    The first group of `pattern` found in the file name is formatted into
+    `name`; files that do not match are left out.
+    """
+    regex = re.compile(pattern)
+    outputs = {}
+    for input_file in input_files:
+        match = regex.search(input_file.name)
+        if match:
+            outputs[input_file] = Path(output_dir) / name.format(*match.groups())
+    return outputs
+
+
+def clean_batch(outputs, workers=None, force=False, timed=False):
+    """Cleans the VTT files in parallel, skipping the up to date transcripts.
+
+    With `timed`, the cues are also written as JSON Lines next to each
+    transcript. Yields the input file and the result of `clean_file`, or
+    the error; a file that fails leaves its old outputs, if any, so it is
+    cleaned again in the next run.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    pending = {
+        input_file: output_file
+        for input_file, output_file in outputs.items()
+        if force
+        or not output_file.exists()
+        or output_file.stat().st_mtime < input_file.stat().st_mtime
+        or timed
+        and not output_file.with_suffix(".jsonl").exists()
+    }
+    if not pending:
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                clean_file,
+                input_file,
+                output_file,
+                output_file.with_suffix(".jsonl") if timed else None,
+            ): input_file
+            for input_file, output_file in pending.items()
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Cleans a VTT file for use in IA prompting"
     )
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--input",
         "-i",
         type=Path,
         help="Path to the input file in vtt format",
     )
+    source.add_argument(
+        "--glob",
+        "-g",
+        help="Clean all the files matching this pattern, like 'input/*.vtt', "
+        "or all the vtt files of a folder",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        type=Path,
+        default=Path("work"),
+        help="Folder of the transcripts in batch mode (default: work)",
+    )
+    parser.add_argument(
+        "--pattern",
+        default=r"UNIT (\d+)",
+        help="Regex whose groups are used in the transcript names "
+        "(default: 'UNIT (\\d+)')",
+    )
+    parser.add_argument(
+        "--name",
+        default="u{}-transcript.txt",
+        help="Name of the transcripts (default: u{}-transcript.txt)",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--force",
+        "-f",
+        action="store_true",
+        help="Clean the files even if their transcripts are up to date",
+    )
+    parser.add_argument(
+        "--jsonl",
+        "-j",
+        type=Path,
+        help="Also write the cues with their times to this JSON Lines file",
+    )
+    parser.add_argument(
+        "--timed",
+        "-t",
+        action="store_true",
+        help="In batch mode, also write the cues with their times as JSON Lines "
+        "next to each transcript",
+    )
+    instrument.add_arguments(parser)
     args = parser.parse_args()
-    if not Path(args.input).exists:
-        sys.exit(f"Input file {args.input} does not exist")
-    preamble = {"WEBVTT", "Kind:", "Language:"}
-    preamble_lines = 0
-    for line in process_lines(args.input):
-        if preamble_lines < len(preamble):
-            if not any(line.startswith(p) for p in preamble):
-                sys.exit(f"Input file {args.input} is not a vtt file {line}")
-            preamble_lines += 1
+    instrument.setup(args)
+    if args.glob:
+        source = Path(args.glob).expanduser()
+        if source.is_dir():
+            input_files = sorted(source.glob("*.vtt"))
         else:
-            print(line)
+            input_files = sorted(Path(p) for p in glob.glob(str(source)))
+        outputs = batch_outputs(input_files, args.output_dir, args.pattern, args.name)
+        if not outputs:
+            sys.exit(f"No files matching {args.glob} and {args.pattern}")
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        failed = 0
+        cleaned = 0
+        results = clean_batch(outputs, args.workers, args.force, args.timed)
+        for input_file, result in results:
+            cleaned += 1
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{input_file}: {result}")
+                continue
+            seconds, input_size, output_size = result
+            print(
+                f"{input_file} -> {outputs[input_file]}: "
+                f"{input_size} -> {output_size} bytes in {seconds:.2f}s"
+            )
+        if cleaned < len(outputs):
+            print(f"{len(outputs) - cleaned} transcripts already up to date")
+        if failed:
+            sys.exit(f"{failed} of {len(outputs)} files failed")
+        sys.exit(0)
+
+    if not Path(args.input).exists():
+        sys.exit(f"Input file {args.input} does not exist")
+    if args.jsonl is None:
+        lines = clean_transcript(args.input)
+    else:
+        lines = write_timed(dedup_cues(read_cues(args.input)), args.jsonl)
+    try:
+        with instrument.span("vtt_parse", input=str(args.input)):
+            sys.stdout.writelines(line + "\n" for line in lines)
+    except ValueError as e:
+        sys.exit(str(e))
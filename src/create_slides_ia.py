@@ -1,17 +1,84 @@
 #!/usr/bin/fades
+from __future__ import annotations
 
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
 from pathlib import Path
 import argparse
 import subprocess
 import configparser
 import json
+import random
 import sys
-import openai  # fades
+import time
+import weakref
+from llm_cache import ResponseCache
+import instrument
+import llm_routes
+import md2json
+from transcript_chunks import chunk_transcript, count_tokens
+
+# asyncio, openai and httpx are slow to import, so they are imported on first use
+if TYPE_CHECKING:
+    import asyncio
+    import openai  # fades
 
 # Configuration file path
 CONFIG_FILE = Path("config.ini")
 PROMPT_TEMPLATES_FILE = Path("prompt_templates.json")
+SYSTEM_MESSAGE = "You are an experienced teacher."
+PROMPT_TEMPLATE = """
+You are going to teach this content:
+{unit_plan}.
+
+Your class is 1 hour long and you are going to teach remotly.
+Create a slide deck with 25 slides with short and easy sentences.
+You can include some unicode emojis mixed in the content to improve the visuals.
+Add some slides that are for students to practice the content.
+Add speaker notes bellow each slide to include
+* include the solution key for the exercises
+* suggests some visuals.
+* additional explanations to review and teach.
+
+Create a markdown file and hide all the traces of your presence.
+
+You have a video transcription as guide on how to teach this content.
+
+{transcription} """
+
+SUMMARY_TEMPLATE = """
+You are preparing a class about this content:
+{unit_plan}.
+
+This is part {part} of {parts} of a video transcription used as guide.
+Summarize the ideas, examples and exercises of this part, in order, as a
+short list. Do not add anything that is not in the transcription.
+
+{transcription} """
+
+DEFAULT_TEMPLATES = {
+    "create_slides": PROMPT_TEMPLATE,
+    "summarize_chunk": SUMMARY_TEMPLATE,
+}
+# Longer transcriptions are summarized by chunks before creating the slides
+MAX_TRANSCRIPTION_TOKENS = 24000
+CHUNK_TOKENS = 6000
+OVERLAP_TOKENS = 200
+
+# Connection settings, overridden by the same keys of [AI_SERVICE]
+TIMEOUT = 600.0
+CONNECT_TIMEOUT = 10.0
+MAX_CONNECTIONS = 20
+
+
+def retry_errors() -> tuple:
+    """Errors worth retrying in batch mode, anything else fails the unit."""
+    import openai  # fades
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+    )
 
 
 def initialize_config() -> configparser.ConfigParser:
@@ -24,6 +91,9 @@ def initialize_config() -> configparser.ConfigParser:
             "api_key": "your_openai_api_key",
             "api_base": "https://your-qwen-endpoint.com/v1",
             "model_name": "qwen-max",
+            "timeout": str(TIMEOUT),
+            "connect_timeout": str(CONNECT_TIMEOUT),
+            "max_connections": str(MAX_CONNECTIONS),
         }
     }
 
@@ -60,19 +130,17 @@ def load_prompt_templates(file_path: Path = PROMPT_TEMPLATES_FILE) -> Dict[str,
 
 
 def check_prompt_templates(file_path: Path = PROMPT_TEMPLATES_FILE) -> Dict[str, str]:
-    """Stores a dictionary of prompt templates to a JSON file.
+    """Adds the missing default prompt templates to the JSON file.
 
     Args:
-        templates (Dict[str, str]): A dictionary of prompt templates.
         file_path (Path): Path to the file where templates will be stored."""
 
-    # prompt_template = load_prompt_templates()
-    prompt_template = dict()
+    prompt_template = load_prompt_templates(file_path)
     flag = False
-    if not prompt_template.get("create_slide", ""):
-        flag = True
-
-        prompt_template["create_slides"] = PROMPT_TEMPLATE
+    for name, template in DEFAULT_TEMPLATES.items():
+        if not prompt_template.get(name, ""):
+            flag = True
+            prompt_template[name] = template
 
     if flag:
         with file_path.open("w", encoding="utf-8") as f:
@@ -114,29 +182,621 @@ def write_file(file_path: Path, content: str) -> None:
     file_path.write_text(content, encoding="utf-8")
 
 
-def generate_chat_completion(prompt: str, config: configparser.ConfigParser) -> str:
-    """Generates a chat completion using the Qwen API."""
-    client = openai.OpenAI(
-        api_key=config["AI_SERVICE"]["api_key"],
-        base_url=config["AI_SERVICE"]["api_base"],
+# Shared clients, per endpoint and, for the async ones, per event loop
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def client_options(config: configparser.ConfigParser) -> dict:
+    """Returns the connection options of the configured endpoint."""
+    import httpx  # fades
+
+    service = config["AI_SERVICE"]
+    max_connections = service.getint("max_connections", MAX_CONNECTIONS)
+    return dict(
+        api_key=service["api_key"],
+        base_url=service["api_base"],
+        timeout=httpx.Timeout(
+            service.getfloat("timeout", TIMEOUT),
+            connect=service.getfloat("connect_timeout", CONNECT_TIMEOUT),
+        ),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
     )
 
-    response = client.chat.completions.create(
-        model=config["AI_SERVICE"]["model_name"],
+
+def get_client(config: configparser.ConfigParser) -> openai.OpenAI:
+    """Returns the client of the configured endpoint, created on first use.
+
+    The client is shared by all the calls of the process, so its pooled
+    connections are kept alive between requests.
+    """
+    import openai  # fades
+
+    options = client_options(config)
+    key = (options["base_url"], options["api_key"])
+    if key not in _clients:
+        _clients[key] = openai.OpenAI(
+            api_key=options["api_key"],
+            base_url=options["base_url"],
+            timeout=options["timeout"],
+            http_client=openai.DefaultHttpxClient(
+                limits=options["limits"], timeout=options["timeout"]
+            ),
+        )
+    return _clients[key]
+
+
+def get_async_client(config: configparser.ConfigParser) -> openai.AsyncOpenAI:
+    """Returns the async client of the configured endpoint for the running loop.
+
+    Async connections can not outlive their event loop, so there is a client
+    per loop. Retries are left to `agenerate_chat_completion`.
+    """
+    import asyncio
+    import openai  # fades
+
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    options = client_options(config)
+    key = (options["base_url"], options["api_key"])
+    if key not in clients:
+        clients[key] = openai.AsyncOpenAI(
+            api_key=options["api_key"],
+            base_url=options["base_url"],
+            timeout=options["timeout"],
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=options["limits"], timeout=options["timeout"]
+            ),
+        )
+    return clients[key]
+
+
+async def close_async_clients() -> None:
+    """Closes the async clients of the running loop, before it finishes."""
+    import asyncio
+
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def build_prompt(templates: Dict[str, str], unit_plan: str, transcription: str) -> str:
+    """Renders the create_slides prompt for a unit."""
+    return templates["create_slides"].format(
+        unit_plan=unit_plan, transcription=transcription
+    )
+
+
+def completion_request(prompt: str, config: configparser.ConfigParser) -> dict:
+    """Builds the arguments of the chat completion request for a prompt.
+
+    The optional `temperature` and `top_p` keys of [AI_SERVICE] are sent as
+    sampling parameters.
+    """
+    service = config["AI_SERVICE"]
+    request = dict(
+        model=service["model_name"],
         messages=[
-            {"role": "system", "content": "You are an experienced teacher."},
+            {"role": "system", "content": SYSTEM_MESSAGE},
             {"role": "user", "content": prompt},
         ],
     )
+    for param in ("temperature", "top_p"):
+        if param in service:
+            request[param] = service.getfloat(param)
+    return request
+
+
+def record_usage(span, usage) -> None:
+    """Adds the tokens of a response to its span and to the run counters."""
+    if usage is None:
+        return
+    span.set(
+        prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens
+    )
+    instrument.count("prompt_tokens", usage.prompt_tokens)
+    instrument.count("completion_tokens", usage.completion_tokens)
 
-    return response.choices[0].message.content
 
+def route_name(config: configparser.ConfigParser) -> str:
+    return config["AI_SERVICE"].get("route", llm_routes.DEFAULT_ROUTE)
 
-def main() -> None:
-    # Initialize configuration
-    config = initialize_config()
-    templates = check_prompt_templates()
 
+def select_chain(prompt: str, config: configparser.ConfigParser) -> List[str]:
+    """The route chosen for the size of the prompt, and its fallbacks."""
+    return llm_routes.route_chain(
+        config, llm_routes.select_route(config, count_tokens(prompt))
+    )
+
+
+def generate_chat_completion(
+    prompt: str,
+    config: configparser.ConfigParser,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> str:
+    """Generates a chat completion using the Qwen API.
+
+    The request goes to the route chosen for the size of the prompt, see
+    `route_chat_completion`.
+    """
+    return route_chat_completion(prompt, config, cache, refresh)[0]
+
+
+def route_chat_completion(
+    prompt: str,
+    config: configparser.ConfigParser,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> Tuple[str, str]:
+    """Generates a chat completion, returns it with the route that served it.
+
+    The request goes to the route chosen for the size of the prompt, see
+    `llm_routes`. When the route has fallbacks, the request is sent as in
+    `aroute_chat_completion`.
+    """
+    chain = select_chain(prompt, config)
+    if len(chain) > 1:
+        return run_async(aroute_chat_completion, prompt, config, cache, refresh)
+    route = llm_routes.route_config(config, chain[0])
+    return request_chat_completion(prompt, route, cache, refresh), chain[0]
+
+
+def request_chat_completion(
+    prompt: str,
+    config: configparser.ConfigParser,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> str:
+    """Generates a chat completion with the endpoint of [AI_SERVICE].
+
+    When a cache is given, a cached response is returned instead of calling
+    the API, unless `refresh` is set. New responses are stored in the cache.
+    """
+    request = completion_request(prompt, config)
+    key = cache.key(request) if cache else None
+    if cache and not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            instrument.count("llm_cache_hits")
+            return cached
+
+    with instrument.span(
+        "llm_request", model=request["model"], route=route_name(config)
+    ) as span:
+        response = get_client(config).chat.completions.create(**request)
+        record_usage(span, response.usage)
+    instrument.count(f"served_by_{route_name(config)}")
+
+    content = response.choices[0].message.content
+    if cache:
+        cache.put(key, content)
+    return content
+
+
+def stream_chat_completion(
+    prompt: str,
+    config: configparser.ConfigParser,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> Iterator[str]:
+    """Yields the text of a chat completion as it is generated.
+
+    The request goes to the route chosen for the size of the prompt, and to
+    its fallbacks when it fails before the first token; a stream already
+    started can not be hedged. The cache is used as in
+    `request_chat_completion`; only a completed response is stored.
+    """
+    chain = select_chain(prompt, config)
+    for position, name in enumerate(chain):
+        route = llm_routes.route_config(config, name)
+        request = completion_request(prompt, route)
+        key = cache.key(request) if cache else None
+        if cache and not refresh:
+            cached = cache.get(key)
+            if cached is not None:
+                instrument.count("llm_cache_hits")
+                yield cached
+                return
+        start = time.monotonic_ns()
+        try:
+            stream = get_client(route).chat.completions.create(**request, stream=True)
+            break
+        except Exception:
+            if position == len(chain) - 1:
+                raise
+            instrument.count("llm_failovers")
+
+    parts = []
+    with instrument.span("llm_stream", model=request["model"], route=name) as span:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    instrument.mark("llm_first_token", start, model=request["model"])
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+            # Only sent by the services that report the usage of streams
+            record_usage(span, getattr(chunk, "usage", None))
+    instrument.count(f"served_by_{name}")
+
+    if cache:
+        cache.put(key, "".join(parts))
+
+
+def write_lines(chunks: Iterable[str], output) -> Iterator[str]:
+    """Writes the chunks to the output as they arrive and yields whole lines."""
+    pending = ""
+    for chunk in chunks:
+        output.write(chunk)
+        output.flush()
+        pending += chunk
+        *lines, pending = pending.split("\n")
+        yield from lines
+    if pending:
+        yield pending
+
+
+def stream_slides(
+    prompt: str,
+    config: configparser.ConfigParser,
+    output: Path,
+    json_output: Path = None,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> int:
+    """Streams the slides into the markdown output while they are generated.
+
+    Each slide is parsed with md2json as soon as its separator arrives and,
+    if `json_output` is given, appended to it as a JSON line. Whatever was
+    received is kept on disk if the connection drops.
+    Returns the number of parsed slides.
+    """
+    count = 0
+    with output.open("w", encoding="utf-8") as f:
+        lines = write_lines(stream_chat_completion(prompt, config, cache, refresh), f)
+        if json_output is None:
+            for _ in lines:
+                pass
+            return count
+        with json_output.open("w", encoding="utf-8") as jf:
+            for slide in md2json.parse_markdown(lines):
+                jf.write(json.dumps(slide, ensure_ascii=False) + "\n")
+                jf.flush()
+                count += 1
+    return count
+
+
+async def agenerate_chat_completion(
+    prompt: str,
+    config: configparser.ConfigParser,
+    client: openai.AsyncOpenAI,
+    retries: int = 5,
+    backoff: float = 2.0,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> str:
+    """Generates a chat completion, retrying rate limits and timeouts.
+
+    The wait between attempts grows exponentially with full jitter, so
+    concurrent units hitting the same limit do not retry in lockstep.
+    The cache is used as in `request_chat_completion`.
+    """
+    import asyncio
+
+    request = completion_request(prompt, config)
+    key = cache.key(request) if cache else None
+    if cache and not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            instrument.count("llm_cache_hits")
+            return cached
+
+    errors = retry_errors()
+    for attempt in range(retries + 1):
+        try:
+            with instrument.span(
+                "llm_request",
+                model=request["model"],
+                route=route_name(config),
+                attempt=attempt,
+            ) as span:
+                response = await client.chat.completions.create(**request)
+                record_usage(span, response.usage)
+            instrument.count(f"served_by_{route_name(config)}")
+            break
+        except errors:
+            if attempt == retries:
+                raise
+            instrument.count("llm_retries")
+            await asyncio.sleep(random.uniform(0, min(60.0, backoff * 2**attempt)))
+
+    content = response.choices[0].message.content
+    if cache:
+        cache.put(key, content)
+    return content
+
+
+async def aroute_chat_completion(
+    prompt: str,
+    config: configparser.ConfigParser,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+    semaphore: asyncio.Semaphore = None,
+) -> Tuple[str, str]:
+    """Generates a chat completion on the route chosen for the prompt size.
+
+    When the route fails, the request goes to its fallback. When it takes
+    longer than the `hedge_after` seconds of the route, the fallback gets
+    the same request, the first answer is used and the others cancelled.
+    Each route retries as in `agenerate_chat_completion`, up to the
+    `retries` of its config. Each request, hedged ones included, takes a
+    slot of the semaphore while it runs. Returns the answer and the name of
+    the route that served it.
+    """
+    import asyncio
+    import contextlib
+
+    chain = select_chain(prompt, config)
+    pending = {}
+    error = None
+
+    async def first_answer(timeout):
+        """The first request to answer, None when one fails or on timeout."""
+        nonlocal error
+        done, _ = await asyncio.wait(
+            pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            instrument.count("llm_hedges")
+        for task in done:
+            del pending[task]
+            if task.exception() is not None:
+                error = task.exception()
+                instrument.count("llm_failovers")
+        answers = [task for task in done if task.exception() is None]
+        return answers[0] if answers else None
+
+    async def request(route):
+        async with semaphore or contextlib.nullcontext():
+            return await agenerate_chat_completion(
+                prompt,
+                route,
+                get_async_client(route),
+                retries=route["AI_SERVICE"].getint("retries", 5),
+                cache=cache,
+                refresh=refresh,
+            )
+
+    with instrument.span("llm_route", route=chain[0]) as span:
+        tasks = {}
+        try:
+            for position, name in enumerate(chain):
+                task = asyncio.ensure_future(
+                    request(llm_routes.route_config(config, name))
+                )
+                pending[task] = tasks[task] = name
+                if position < len(chain) - 1:
+                    answer = await first_answer(llm_routes.hedge_after(config, name))
+                    if answer is not None:
+                        break
+            else:
+                answer = None
+                while pending and answer is None:
+                    answer = await first_answer(None)
+        finally:
+            for task in pending:
+                task.cancel()
+            # Waits for the cancelled requests to close their connections
+            await asyncio.gather(*pending, return_exceptions=True)
+        if answer is None:
+            raise error
+        span.set(served=tasks[answer], requests=len(tasks))
+        return answer.result(), tasks[answer]
+
+
+def run_async(function, *args):
+    """Runs the coroutine function from synchronous code."""
+    import asyncio
+
+    async def run():
+        try:
+            return await function(*args)
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(run())
+
+
+async def summarize_transcription(
+    transcription: str,
+    unit_plan: str,
+    templates: Dict[str, str],
+    config: configparser.ConfigParser,
+    semaphore: asyncio.Semaphore,
+    max_tokens: int = MAX_TRANSCRIPTION_TOKENS,
+    chunk_tokens: int = CHUNK_TOKENS,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+    served: List[str] = None,
+) -> str:
+    """Condenses a transcription longer than max_tokens.
+
+    The transcription is split in overlapping chunks along sentences, the
+    chunks are summarized concurrently and the summaries are returned, in
+    order, to be used as the transcription of the slides prompt. The routes
+    that served the summaries are added to `served`, when given.
+    """
+    import asyncio
+
+    if count_tokens(transcription) <= max_tokens:
+        return transcription
+
+    chunks = chunk_transcript(transcription.splitlines(), chunk_tokens, OVERLAP_TOKENS)
+    template = templates.get("summarize_chunk", SUMMARY_TEMPLATE)
+
+    async def summarize(part, chunk):
+        prompt = template.format(
+            unit_plan=unit_plan, part=part, parts=len(chunks), transcription=chunk
+        )
+        summary, route = await aroute_chat_completion(
+            prompt, config, cache, refresh, semaphore
+        )
+        if served is not None:
+            served.append(route)
+        return summary
+
+    summaries = await asyncio.gather(
+        *(summarize(part, chunk) for part, chunk in enumerate(chunks, 1))
+    )
+    return "\n\n".join(summaries)
+
+
+def condense_transcription(
+    transcription: str,
+    unit_plan: str,
+    templates: Dict[str, str],
+    config: configparser.ConfigParser,
+    concurrency: int = 4,
+    max_tokens: int = MAX_TRANSCRIPTION_TOKENS,
+    chunk_tokens: int = CHUNK_TOKENS,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+) -> str:
+    """Runs `summarize_transcription` from synchronous code."""
+    import asyncio
+
+    if count_tokens(transcription) <= max_tokens:
+        return transcription
+
+    async def run():
+        return await summarize_transcription(
+            transcription,
+            unit_plan,
+            templates,
+            config,
+            asyncio.Semaphore(concurrency),
+            max_tokens,
+            chunk_tokens,
+            cache,
+            refresh,
+        )
+
+    return run_async(run)
+
+
+def load_manifest(file_path: Path) -> List[Dict[str, Path]]:
+    """Loads the list of units to generate in batch mode.
+
+    The manifest is a JSON list of objects with the `file` (transcription),
+    `unit_plan` and `output` paths of each unit, relative to the manifest.
+    """
+    with file_path.open("r", encoding="utf-8") as f:
+        units = json.load(f)
+    base = file_path.parent
+    manifest = []
+    for idx, unit in enumerate(units):
+        missing = {"file", "unit_plan", "output"} - set(unit)
+        if missing:
+            sys.exit(
+                f"Error: Unit {idx} of {file_path} lacks {', '.join(sorted(missing))}"
+            )
+        manifest.append(
+            {key: base / unit[key] for key in ("file", "unit_plan", "output")}
+        )
+    return manifest
+
+
+async def generate_unit(
+    unit: Dict[str, Path],
+    templates: Dict[str, str],
+    config: configparser.ConfigParser,
+    semaphore: asyncio.Semaphore,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+    max_tokens: int = MAX_TRANSCRIPTION_TOKENS,
+    chunk_tokens: int = CHUNK_TOKENS,
+) -> Tuple[float, List[str]]:
+    """Generates the slides of a unit and writes them as soon as they arrive.
+
+    Returns the seconds spent and the routes that served the requests.
+    """
+    start = time.perf_counter()
+    served = []
+    unit_plan = read_file(unit["unit_plan"])
+    transcription = await summarize_transcription(
+        read_file(unit["file"]),
+        unit_plan,
+        templates,
+        config,
+        semaphore,
+        max_tokens,
+        chunk_tokens,
+        cache,
+        refresh,
+        served,
+    )
+    prompt = build_prompt(templates, unit_plan, transcription)
+    slides, route = await aroute_chat_completion(
+        prompt, config, cache, refresh, semaphore
+    )
+    served.append(route)
+    write_file(unit["output"], slides)
+    return time.perf_counter() - start, served
+
+
+async def run_batch(
+    units: List[Dict[str, Path]],
+    templates: Dict[str, str],
+    config: configparser.ConfigParser,
+    concurrency: int = 4,
+    cache: ResponseCache = None,
+    refresh: bool = False,
+    max_tokens: int = MAX_TRANSCRIPTION_TOKENS,
+    chunk_tokens: int = CHUNK_TOKENS,
+) -> int:
+    """Generates all the units, at most `concurrency` requests at a time.
+
+    Returns the number of units that failed.
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(unit):
+        try:
+            return unit, await generate_unit(
+                unit,
+                templates,
+                config,
+                semaphore,
+                cache,
+                refresh,
+                max_tokens,
+                chunk_tokens,
+            )
+        except Exception as e:
+            return unit, e
+
+    failed = 0
+    try:
+        for task in asyncio.as_completed([run(unit) for unit in units]):
+            unit, result = await task
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"Failed {unit['file']}: {result}")
+            else:
+                seconds, served = result
+                routes = ", ".join(sorted(set(served)))
+                print(f"Wrote {unit['output']} in {seconds:.1f}s, served by {routes}")
+    finally:
+        await close_async_clients()
+    return failed
+
+
+def main() -> None:
     # Parse command-line arguments
     parser = argparse.ArgumentParser(
         description="Process a video transcription and creates a slide deck."
@@ -150,7 +810,84 @@ def main() -> None:
     parser.add_argument(
         "--output", "-o", type=Path, help="Path to the slides markdown file."
     )
+    parser.add_argument(
+        "--batch",
+        "-b",
+        type=Path,
+        help="JSON manifest of units to generate concurrently, "
+        "each with its file, unit_plan and output paths.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        "-c",
+        type=int,
+        default=4,
+        help="Maximum number of requests sent at the same time.",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=MAX_TRANSCRIPTION_TOKENS,
+        help="Transcriptions longer than this are summarized by chunks first.",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=CHUNK_TOKENS,
+        help="Size of the transcription chunks to summarize.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the local cache of responses.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ask the model again and update the cached responses.",
+    )
+    parser.add_argument(
+        "--stream",
+        "-s",
+        action="store_true",
+        help="Write the slides to the output while they are generated.",
+    )
+    parser.add_argument(
+        "--json",
+        "-j",
+        type=Path,
+        help="With --stream, also write each parsed slide to this JSON Lines file.",
+    )
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.setup(args)
+
+    # Initialize configuration
+    config = initialize_config()
+    check_prompt_templates()
+    cache = None if args.no_cache else ResponseCache()
+
+    if args.batch:
+        if not args.batch.exists():
+            sys.exit(f"Error: Manifest file not found at {args.batch}")
+        import asyncio
+
+        units = load_manifest(args.batch)
+        failed = asyncio.run(
+            run_batch(
+                units,
+                load_prompt_templates(),
+                config,
+                args.concurrency,
+                cache,
+                args.refresh,
+                args.max_tokens,
+                args.chunk_tokens,
+            )
+        )
+        if failed:
+            sys.exit(f"Error: {failed} of {len(units)} units failed")
+        return
 
     input_file = Path(args.file or " ")
     if not args.unit_plan:
@@ -164,34 +901,37 @@ def main() -> None:
         sys.exit(f"Error: Input file not found at {input_file}")
 
     prompt_templates = load_prompt_templates()
-    prompt = prompt_templates["create_slides"].format(
-        unit_plan=unit_plan_text, transcription=read_file(args.file)
+    transcription = read_file(args.file)
+    print(f"Transcription has about {count_tokens(transcription)} tokens")
+    transcription = condense_transcription(
+        transcription,
+        unit_plan_text,
+        prompt_templates,
+        config,
+        args.concurrency,
+        args.max_tokens,
+        args.chunk_tokens,
+        cache,
+        args.refresh,
     )
+    prompt = build_prompt(prompt_templates, unit_plan_text, transcription)
     write_file(Path("last_prompt.txt"), prompt)
-    print(f"Prompt has {len(prompt)} characters and {len(prompt.split('\n'))} lines")
-    slides = generate_chat_completion(prompt, config)
+    print(
+        f"Prompt has {len(prompt)} characters, {len(prompt.splitlines())} lines"
+        f" and about {count_tokens(prompt)} tokens"
+    )
+    if args.stream:
+        count = stream_slides(
+            prompt, config, args.output, args.json, cache, args.refresh
+        )
+        if args.json:
+            print(f"{count} slides written to {args.json}")
+        return
+    slides, route = route_chat_completion(prompt, config, cache, args.refresh)
+    print(f"Slides served by the {route} route")
 
     write_file(args.output, slides)
 
 
 if __name__ == "__main__":
     main()
-
-PROMPT_TEMPLATE = """
-You are going to teach this content:
-{unit_plan}.
-
-Your class is 1 hour long and you are going to teach remotly.
-Create a slide deck with 25 slides with short and easy sentences.
-You can include some unicode emojis mixed in the content to improve the visuals.
-Add some slides that are for students to practice the content.
-Add speaker notes bellow each slide to include
-* include the solution key for the exercises
-* suggests some visuals.
-* additional explanations to review and teach.
-
-Create a markdown file and hide all the traces of your presence.
-
-You have a video transcription as guide on how to teach this content.
-
-{transcription} """
@@ -1,41 +1,55 @@
 #!/usr/bin/fades
 import warnings
-import random
+import argparse
+import io
 import json
+import time
+import zipfile
+from functools import lru_cache
 from pathlib import Path
 import sys
 
-from pptx import Presentation  # fades python-pptx
-from pptx.util import Inches
-from process_template import Layouts, Layout
-from rich.console import Console  # fades rich
+import instrument
+from image_cache import prepare_picture
+from process_template import STRATEGIES, Layouts
+from template_cache import load_layouts
+from md2json import inline_runs
 
 import logging
 
-console = Console()
-
 # --- Set up warning logging to file ---
 log_file = "warnings.log"
 
-# Configure the logging system
-logging.basicConfig(
-    level=logging.WARNING,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(log_file),
-    ],
-)
-# Route warnings through the logging system
-logging.captureWarnings(True)
-
 
 def _null_warning(*args, **kwargs): ...
 
 
-warnings.showwarning = _null_warning  # Suppress all direct warning outputs
+@lru_cache
+def setup_logging():
+    """Sends the warnings to the log file, done once before rendering."""
+    # Configure the logging system
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(log_file),
+        ],
+    )
+    # Route warnings through the logging system
+    logging.captureWarnings(True)
+    warnings.showwarning = _null_warning  # Suppress all direct warning outputs
+
+
+@lru_cache
+def get_console():
+    """The rich console, created on first use as rich is slow to import."""
+    from rich.console import Console  # fades rich
+
+    return Console()
 
 
 def output(*args):
+    console = get_console()
     for arg in args:
         console.print(arg)
 
@@ -44,33 +58,34 @@ def add_content(plh, content):
     text_frame = plh.text_frame
     text_frame.clear()
     for line in content:
-        line = line.strip()
         p = text_frame.add_paragraph()
-        if line.startswith("-"):
-            text = line[1:].strip()  # Remove '- '
-            p.level = 0
-        else:
-            text = line
-        bold = False
-        for clean_text in text.split("**"):
-            # Basic markdown bold handling
-            text = clean_text.replace("*", " ").strip()
-            if text:
-                run = p.add_run()
-                run.text = text + " "
-                run.font.bold = bold
-            bold = not bold
+        level, runs = inline_runs(line)
+        if level is not None:
+            p.level = min(level, 8)
+        for part in runs:
+            run = p.add_run()
+            run.text = part.text
+            run.font.bold = part.bold
+            run.font.italic = part.italic or None
 
 
 def add_images_notes(slide, slide_data):
+    from pptx.util import Inches
+
     notes = slide_data.get("notes", [])
     visuals = slide_data.get("visual", [])
     if visuals and len(slide.shapes) > 0:
         # Add image to the right of content (example placement)
         left = Inches(5)
         top = Inches(1.5)
+        height = Inches(3)
+        slide_width = slide.part.package.presentation_part.presentation.slide_width
         try:
-            slide.shapes.add_picture(visuals[0], left, top, height=Inches(3))
+            # The picture is scaled down to the frame it can take at most
+            picture = prepare_picture(
+                visuals[0], (slide_width - left) / Inches(1), height / Inches(1)
+            )
+            slide.shapes.add_picture(str(picture), left, top, height=height)
         except Exception as e:
             notes.extend(["Visuals:"] + visuals)
             logging.debug(f"Error adding image: {e}")
@@ -88,32 +103,71 @@ def add_images_notes_(slide, slide_data):
     notes_slide.notes_text_frame.text = "\n".join(notes)
 
 
-def add_slide(prs, slide_data, map):
-    layouts = map.get_fitted_layouts(slide_data)
-    random.shuffle(layouts)
-    layout = layouts[0]
+def add_slide(prs, slide_data, map, chooser):
+    with instrument.span("fit_layout") as span:
+        layout = chooser.choose(map.get_fitted_layouts(slide_data), slide_data)
+        _, placeholders = layout.get_fitting(slide_data)
+        span.set(layout=layout.name)
     slide = prs.slides.add_slide(layout.obj)
 
-    layout = Layout.new_from_slide(slide)
-    _, placeholders = layout.get_fitting(slide_data)
     # output(placeholders)
-    for part in ["title", "content"]:
-        if placeholders[part]:
-            add_content(placeholders[part].obj, slide_data[part])
-        else:
-            slide_data["notes"].extend(
-                ["Placeholder not found:"] + [part] + slide_data[part]
-            )
+    with instrument.span("add_content"):
+        for part in ["title", "content"]:
+            if not slide_data.get(part):
+                continue
+            if placeholders.get(part):
+                add_content(
+                    slide.placeholders[placeholders[part].key], slide_data[part]
+                )
+            else:
+                slide_data["notes"].extend(
+                    ["Placeholder not found:"] + [part] + slide_data[part]
+                )
     if slide:
-        add_images_notes(slide, slide_data)
+        with instrument.span("add_images_notes"):
+            add_images_notes(slide, slide_data)
         return 1
     return 0
 
 
-def create_presentation(template_path, json_path, output_path):
+def save_presentation(prs, output_path):
+    """Saves the presentation with fixed zip timestamps.
+
+    python-pptx stamps every zip entry with the time of the save, so the
+    same deck saved twice would not be byte-identical.
+    """
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    with zipfile.ZipFile(buffer) as source, zipfile.ZipFile(
+        output_path, "w", zipfile.ZIP_DEFLATED
+    ) as target:
+        for info in source.infolist():
+            entry = zipfile.ZipInfo(info.filename, date_time=(1980, 1, 1, 0, 0, 0))
+            entry.compress_type = info.compress_type
+            target.writestr(entry, source.read(info))
+
+
+def build_presentation(
+    template_path, slides_data, output_path, records=None, strategy="random", seed=0
+):
+    """Renders the slides, given as an iterable of dicts, with the template.
+
+    `records` are the `Layouts.to_records` of the template, to skip its
+    analysis when many decks are rendered with it. `strategy`, a key of
+    STRATEGIES, chooses among the layouts that fit a slide equally well,
+    and the same slides, strategy and seed always give the same file.
+    """
+    from pptx import Presentation  # fades python-pptx
+
+    setup_logging()
     # Load the template presentation
-    prs = Presentation(template_path)
-    map = Layouts(template_path)
+    with instrument.span("template_load", template=str(template_path)):
+        prs = Presentation(template_path)
+        if records is not None:
+            map = Layouts.from_records(records, prs)
+        else:
+            map = load_layouts(template_path, prs)
+    chooser = STRATEGIES[strategy](seed)
 
     previous_slides = len(prs.slides)
     if previous_slides > 0:
@@ -122,46 +176,199 @@ def create_presentation(template_path, json_path, output_path):
             "Cannot be removed.",
         )
 
-    # Load the JSON data
-    with open(json_path, "r") as f:
-        slides_data = json.load(f)
-
     new_slides = 0
-    for idx, slide_data in enumerate(slides_data):
-        logging.debug(
-            f"Slide {idx + 1}/{len(slides_data)} {' '.join(slide_data.keys())}"
-        )
-        new_slides += add_slide(prs, slide_data, map)
+    loaded_data = 0
+    for loaded_data, slide_data in enumerate(slides_data, 1):
+        logging.debug(f"Slide {loaded_data} {' '.join(slide_data.keys())}")
+        new_slides += add_slide(prs, slide_data, map, chooser)
 
     # Save the presentation
-    prs.save(output_path)
+    with instrument.span("save", slides=len(prs.slides)):
+        save_presentation(prs, output_path)
     return dict(
-        loaded_data=len(slides_data),
+        loaded_data=loaded_data,
         new_slides=new_slides,
         total_slides=len(prs.slides),
         previous_slides=previous_slides,
     )
 
 
-# Usage
-if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        output(
-            "Usage: python create_w_template.py <source.json> <template.potx> <output.pptx>"
+def read_json_lines(json_path):
+    """Yields the slides of a JSON Lines file, one by one."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def create_presentation(
+    template_path, json_path, output_path, records=None, strategy="random", seed=0
+):
+    # Load the JSON data, streaming it when it is JSON Lines
+    if str(json_path).endswith(".jsonl"):
+        slides_data = read_json_lines(json_path)
+    else:
+        with open(json_path, "r") as f:
+            slides_data = json.load(f)
+
+    return build_presentation(
+        template_path, slides_data, output_path, records, strategy, seed
+    )
+
+
+# Template, layout records and strategy of the workers of `render_decks`
+_shared = {}
+
+
+def _init_worker(template_path, records, strategy, seed):
+    _shared.update(
+        template_path=template_path, records=records, strategy=strategy, seed=seed
+    )
+
+
+def _render_deck(json_path, output_path):
+    start = time.perf_counter()
+    with instrument.span("render_deck", deck=str(output_path)):
+        stats = create_presentation(
+            json_path=json_path, output_path=output_path, **_shared
         )
-        sys.exit(1)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
 
-    source_json = sys.argv[1]
-    template_ppt = sys.argv[2]
-    output_ppt = sys.argv[3]
-    fn = Path(source_json).expanduser().resolve()
-    if not fn.exists():
-        sys.exit(f"Source JSON file not found: {source_json}")
 
-    fn = Path(template_ppt).expanduser().resolve()
-    if not fn.exists():
-        sys.exit(f"Template file not found: {template_ppt}")
-    stats = create_presentation(
-        template_path=str(fn), json_path=source_json, output_path=output_ppt
+def render_decks(template_path, decks, workers=None, strategy="random", seed=0):
+    """Renders many decks with the same template, in parallel.
+
+    `decks` are (slides json, output pptx) pairs. The template is analyzed
+    once, and its layouts are given to each worker process when it starts.
+    Yields the json path, the output path and the stats of each deck, or
+    the error that stopped it, as they finish.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    records = load_layouts(template_path).to_records()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(str(template_path), records, strategy, seed),
+    ) as pool:
+        futures = {
+            pool.submit(_render_deck, json_path, output_path): (json_path, output_path)
+            for json_path, output_path in decks
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            yield *futures[future], result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Creates presentations from slides json files and a template.",
+        usage="%(prog)s <source.json> <template.potx> <output.pptx>\n"
+        "       %(prog)s --batch <template.potx> <slides.json>... "
+        "[--output-dir DIR] [--workers N]",
+    )
+    parser.add_argument(
+        "files", nargs="+", help="The source json, template and output pptx."
+    )
+    parser.add_argument(
+        "--batch",
+        "-b",
+        action="store_true",
+        help="Render each of the slides files after the template, in parallel.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-d",
+        type=Path,
+        help="Folder of the decks in batch mode (default: next to each input). "
+        "Each deck is named as its slides file, with a .pptx suffix.",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Decks rendered in parallel (default: one per CPU).",
+    )
+    parser.add_argument(
+        "--strategy",
+        "-s",
+        choices=list(STRATEGIES),
+        default="random",
+        help="How to choose among the layouts that fit a slide equally well: "
+        "seeded random, round robin per slide fields, or the least recently "
+        "used (default: random).",
     )
-    output(stats, f"Template applied and saved to: {output_ppt}")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the random strategy, the same seed gives the same deck "
+        "(default: 0).",
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    if not args.batch:
+        if len(args.files) != 3:
+            parser.error("expected <source.json> <template.potx> <output.pptx>")
+        source_json, template_ppt, output_ppt = args.files
+        fn = Path(source_json).expanduser().resolve()
+        if not fn.exists():
+            sys.exit(f"Source JSON file not found: {source_json}")
+
+        fn = Path(template_ppt).expanduser().resolve()
+        if not fn.exists():
+            sys.exit(f"Template file not found: {template_ppt}")
+        stats = create_presentation(
+            template_path=str(fn),
+            json_path=source_json,
+            output_path=output_ppt,
+            strategy=args.strategy,
+            seed=args.seed,
+        )
+        output(stats, f"Template applied and saved to: {output_ppt}")
+        return
+
+    template_ppt, *sources = args.files
+    template = Path(template_ppt).expanduser().resolve()
+    if not template.exists():
+        sys.exit(f"Template file not found: {template_ppt}")
+    missing = [source for source in sources if not Path(source).exists()]
+    if missing:
+        sys.exit(f"Source JSON files not found: {', '.join(missing)}")
+    if args.output_dir:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+    decks = [
+        (
+            source,
+            Path(args.output_dir or Path(source).parent) / f"{Path(source).stem}.pptx",
+        )
+        for source in sources
+    ]
+
+    failed = 0
+    start = time.perf_counter()
+    for source, output_ppt, result in render_decks(
+        template, decks, args.workers, args.strategy, args.seed
+    ):
+        if isinstance(result, Exception):
+            failed += 1
+            output(f"{source}: failed, {result}")
+        else:
+            output(
+                f"{output_ppt}: {result['new_slides']} slides "
+                f"in {result['seconds']:.1f}s"
+            )
+    output(f"{len(decks)} decks in {time.perf_counter() - start:.1f}s")
+    if failed:
+        sys.exit(f"{failed} of {len(decks)} decks failed")
+
+
+if __name__ == "__main__":
+    main()
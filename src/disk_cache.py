@@ -0,0 +1,51 @@
+"""Helpers of the on disk caches: their folder, file hashes and eviction.
+
+The caches live under `$SLIDES_CACHE_DIR`, `~/.cache/automate_slides` by
+default, each one in its own folder, and are kept under a size limit by
+removing the least recently used entries.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+CACHE_ROOT = Path(
+    os.environ.get("SLIDES_CACHE_DIR", "~/.cache/automate_slides")
+).expanduser()
+
+
+def file_hash(path) -> str:
+    """Hashes the content of a file, reading it by chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def touch(entry: Path) -> None:
+    """Marks a cache entry as used, so `evict` keeps it longer."""
+    os.utime(entry)
+
+
+def evict(cache_dir: Path, max_bytes: int) -> None:
+    """Removes the least recently used entries until the folder fits max_bytes.
+
+    The temporary files of the entries being written, maybe by other
+    processes, are left alone.
+    """
+    entries = []
+    for entry in Path(cache_dir).iterdir():
+        if entry.suffix == ".tmp":
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        entry.unlink(missing_ok=True)
+        total -= size
@@ -0,0 +1,141 @@
+#!/usr/bin/fades
+"""A local OpenAI compatible server that answers with synthetic slides.
+
+It lets the LLM stage run offline, for the benchmarks or to try the
+scripts, pointing `api_base` of config.ini to it. Every chat completion
+gets the same deck of `slides` slides, streamed when asked, after waiting
+`latency` seconds, as a remote model would.
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the unit talks about food and drinks, how to order in a restaurant "
+    "and how to ask for the bill, with useful phrases and examples"
+).split()
+
+
+def slides_markdown(slides, seed=0):
+    """Returns a deck of slides in the Markdown format of the prompt."""
+
+    def words(n, offset):
+        return " ".join(WORDS[(offset + i) % len(WORDS)] for i in range(n))
+
+    parts = []
+    for n in range(slides):
+        k = seed + n
+        parts.append(
+            f"### Slide {n + 1}: {words(4, k).capitalize()}\n"
+            f"- {words(8, k + 1)}\n"
+            f"- **{words(2, k + 2)}** {words(6, k + 3)}\n"
+            f"- *{words(3, k + 4)}*\n"
+            f"Visual: {words(5, k + 5)}\n"
+            f"Speaker notes: {words(20, k + 6)}\n"
+        )
+    return "---\n".join(parts)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    slides = 10
+    latency = 0.0
+    chunk_size = 40
+
+    def log_message(self, *args): ...
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, dict(error=dict(message=f"Unknown path {self.path}")))
+            return
+        time.sleep(self.latency)
+        text = slides_markdown(self.slides)
+        prompt = sum(len(m.get("content", "")) for m in request.get("messages", []))
+        usage = dict(
+            prompt_tokens=prompt // 4,
+            completion_tokens=len(text) // 4,
+            total_tokens=(prompt + len(text)) // 4,
+        )
+        if not request.get("stream"):
+            message = dict(role="assistant", content=text)
+            choice = dict(index=0, message=message, finish_reason="stop")
+            self.send_json(
+                200,
+                dict(
+                    id="fake",
+                    object="chat.completion",
+                    created=int(time.time()),
+                    model=request.get("model", "fake"),
+                    choices=[choice],
+                    usage=usage,
+                ),
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for start in range(0, len(text), self.chunk_size):
+            delta = dict(content=text[start : start + self.chunk_size])
+            chunk = dict(
+                id="fake",
+                object="chat.completion.chunk",
+                created=int(time.time()),
+                model=request.get("model", "fake"),
+                choices=[dict(index=0, delta=delta, finish_reason=None)],
+            )
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_server(port=0, slides=10, latency=0.0):
+    """Serves in a background thread, returns the server and its base url.
+
+    With port 0 a free port is used. Call `server.shutdown()` to stop it.
+    """
+    handler = type("Handler", (FakeLLMHandler,), dict(slides=slides, latency=latency))
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves an OpenAI compatible API that answers synthetic slides."
+    )
+    parser.add_argument("--port", "-p", type=int, default=8765, help="Port.")
+    parser.add_argument(
+        "--slides", "-n", type=int, default=10, help="Slides per answer."
+    )
+    parser.add_argument(
+        "--latency", "-l", type=float, default=0.0, help="Seconds before answering."
+    )
+    args = parser.parse_args()
+
+    handler = type(
+        "Handler",
+        (FakeLLMHandler,),
+        dict(slides=args.slides, latency=args.latency),
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"Serving on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
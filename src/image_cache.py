@@ -0,0 +1,91 @@
+"""On disk cache of the pictures of the slides, scaled down to their frame.
+
+Pictures are keyed by the hash of their content and the frame size, so the
+same picture used in many slides or units is scaled once, and every deck
+embeds the same small file, that python-pptx stores only once per deck.
+The cache directory is kept under a size limit by removing the least
+recently used entries.
+"""
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from disk_cache import CACHE_ROOT, evict, file_hash, touch
+
+CACHE_DIR = CACHE_ROOT / "images"
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+# Pixels per inch of the scaled pictures, enough for a projected slide
+DPI = 150
+# Formats kept as they are, anything else is saved as png
+FORMATS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif"}
+SUFFIXES = (".jpg", ".png", ".gif")
+# EXIF tag of the orientation a camera saved the photo with
+ORIENTATION = 0x0112
+
+
+@lru_cache(maxsize=1024)
+def _content_hash(path: str, size: int, mtime_ns: int) -> str:
+    return file_hash(path)
+
+
+def content_hash(path: Path) -> str:
+    """Hashes the picture content, once per process while it is not modified."""
+    stat = path.stat()
+    return _content_hash(str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def scale_picture(source: Path, name: Path, box):
+    """Saves the picture scaled down to fit in box, in pixels, and upright.
+
+    The entry is name with the suffix of the picture format, and is returned.
+    Returns None, without saving, when the picture fits and is upright.
+    """
+    from PIL import Image, ImageOps  # fades pillow
+
+    with Image.open(source) as image:
+        upright = image.getexif().get(ORIENTATION, 1) == 1
+        if upright and image.width <= box[0] and image.height <= box[1]:
+            return None
+        image_format = image.format
+        # Rotated photos are turned as they are shown before they are scaled
+        ImageOps.exif_transpose(image, in_place=True)
+        image.thumbnail(box, Image.LANCZOS)
+        entry = name.with_name(name.name + FORMATS.get(image_format, ".png"))
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        if image_format == "JPEG":
+            image.save(tmp, "JPEG", quality=85, optimize=True)
+        else:
+            image.save(tmp, FORMATS.get(image_format, ".png")[1:].upper())
+    os.replace(tmp, entry)
+    return entry
+
+
+def prepare_picture(
+    filename, width, height, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES
+) -> Path:
+    """Returns the picture to embed in a frame of width x height inches.
+
+    Bigger pictures are scaled down to DPI and cached, smaller ones are
+    returned as they are. The picture is only opened when it is not cached.
+    Use `cache_dir=None` to skip the cache.
+    """
+    path = Path(filename)
+    if cache_dir is None:
+        return path
+    box = (round(width * DPI), round(height * DPI))
+    name = Path(cache_dir) / f"{content_hash(path)}-{box[0]}x{box[1]}"
+    for suffix in SUFFIXES:
+        entry = name.with_name(name.name + suffix)
+        if entry.exists():
+            touch(entry)
+            return entry
+    try:
+        entry = scale_picture(path, name, box)
+        if entry is None:
+            return path
+        evict(entry.parent, max_bytes)
+    except OSError:
+        return path  # The picture is embedded as it is
+    return entry
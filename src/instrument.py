@@ -0,0 +1,285 @@
+"""Spans and counters of a run, written as a JSON report and a Chrome trace.
+
+Instrumentation is off unless `enable` is called, usually through the
+`--report` and `--trace` options added by `add_arguments`, or the
+SLIDES_REPORT and SLIDES_TRACE environment variables. When it is off, `span`
+returns a shared context manager that does nothing and `count` returns at
+once, so the instrumented code can stay in production runs.
+
+Worker processes inherit the settings: each one writes its events next to
+the report when it exits, and the process that enabled it merges them.
+
+    with span("save", slides=12):
+        prs.save(path)
+    count("prompt_tokens", usage.prompt_tokens)
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+ENV_REPORT = "SLIDES_REPORT"
+ENV_TRACE = "SLIDES_TRACE"
+ENV_OWNER = "SLIDES_REPORT_OWNER"
+
+_recorder = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args): ...
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("recorder", "name", "args", "start")
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.recorder.add(self.name, self.start, time.monotonic_ns(), self.args)
+        return False
+
+    def set(self, **args):
+        """Adds arguments known once the span started, like token counts."""
+        self.args.update(args)
+
+
+class Recorder:
+    def __init__(self, report, trace=None, owner=None):
+        self.pid = os.getpid()
+        self.retarget(report, trace, owner)
+        self.start = time.monotonic_ns()
+        self.started = time.time()
+        self.events = []
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def retarget(self, report, trace=None, owner=None):
+        """Sets the files written at exit, and the process that writes them."""
+        self.report = Path(report)
+        self.trace = Path(trace) if trace else None
+        self.owner = owner or os.getpid()
+
+    @property
+    def parts(self):
+        return self.report.with_name(self.report.name + ".parts")
+
+    def add(self, name, start, end, args):
+        event = (name, start, end, os.getpid(), _track(), args)
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def process_data(self):
+        import resource
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return dict(
+            pid=os.getpid(),
+            events=self.events,
+            counters=self.counters,
+            cpu_seconds=round(usage.ru_utime + usage.ru_stime, 3),
+            peak_rss_mb=round(usage.ru_maxrss / 1024, 1),
+        )
+
+    def finish(self):
+        """Saves the events of a worker, or writes the report in the owner."""
+        data = self.process_data()
+        if os.getpid() != self.owner:
+            self.parts.mkdir(parents=True, exist_ok=True)
+            with open(self.parts / f"{os.getpid()}.json", "w") as f:
+                json.dump(data, f)
+            return
+        processes = [data]
+        if self.parts.exists():
+            for part in sorted(self.parts.glob("*.json")):
+                with open(part) as f:
+                    processes.append(json.load(f))
+                part.unlink()
+            self.parts.rmdir()
+        self.write_report(processes)
+        if self.trace:
+            self.write_trace(processes)
+
+    def write_report(self, processes):
+        stages = {}
+        counters = {}
+        for process in processes:
+            for name, start, end, *_ in process["events"]:
+                stages.setdefault(name, []).append((end - start) / 1e9)
+            for name, value in process["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+        report = dict(
+            started=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            wall_seconds=round((time.monotonic_ns() - self.start) / 1e9, 3),
+            stages={name: summary(times) for name, times in sorted(stages.items())},
+            counters=counters,
+            processes=[
+                dict(
+                    pid=p["pid"],
+                    events=len(p["events"]),
+                    cpu_seconds=p["cpu_seconds"],
+                    peak_rss_mb=p["peak_rss_mb"],
+                )
+                for p in processes
+            ],
+        )
+        with open(self.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    def write_trace(self, processes):
+        """Writes the events in the Chrome trace format, for chrome://tracing."""
+        events = []
+        for process in processes:
+            for name, start, end, pid, track, args in process["events"]:
+                events.append(
+                    dict(
+                        name=name,
+                        ph="X",
+                        ts=(start - self.start) / 1000,
+                        dur=(end - start) / 1000,
+                        pid=pid,
+                        tid=track,
+                        args=args,
+                    )
+                )
+        with open(self.trace, "w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+
+
+def summary(times):
+    times = sorted(times)
+    return dict(
+        count=len(times),
+        total=round(sum(times), 6),
+        mean=round(sum(times) / len(times), 6),
+        p50=round(times[len(times) // 2], 6),
+        p95=round(times[int(len(times) * 0.95)], 6),
+        max=round(times[-1], 6),
+    )
+
+
+def _track():
+    """The thread, or the asyncio task, as overlapping spans need their own."""
+    asyncio = __import__("sys").modules.get("asyncio")
+    if asyncio is not None:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return id(task) % 1_000_000
+    return threading.get_ident() % 1_000_000
+
+
+def span(name, **args):
+    """Times the block as a span, when the instrumentation is enabled."""
+    if _recorder is None:
+        return NULL_SPAN
+    return Span(_recorder, name, args)
+
+
+def mark(name, start, **args):
+    """Records a span from start, a `time.monotonic_ns()`, to now.
+
+    For spans that do not match a block, like the time to the first token.
+    """
+    if _recorder is not None:
+        _recorder.add(name, start, time.monotonic_ns(), args)
+
+
+def count(name, value=1):
+    """Adds value to a counter of the report, like the tokens used."""
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def _start(report, trace=None, owner=None):
+    import multiprocessing.util
+
+    if _recorder is None:
+        # Run in the workers once multiprocessing dropped the finalizers
+        multiprocessing.util.register_after_fork(Recorder, _forked)
+    elif _recorder.pid == os.getpid():
+        # Enabled again, like --report with SLIDES_REPORT set, a single
+        # recorder writes the report
+        _recorder.retarget(report, trace, owner)
+        return
+    _record(Recorder(report, trace, owner))
+
+
+def _record(recorder):
+    global _recorder
+    import multiprocessing.util
+
+    _recorder = recorder
+    # Runs at exit in the main process and in the multiprocessing workers
+    multiprocessing.util.Finalize(recorder, recorder.finish, exitpriority=100)
+
+
+def _forked(_):
+    # A worker starts with no events, and saves its own at exit
+    _record(Recorder(_recorder.report, _recorder.trace, _recorder.owner))
+
+
+def enable(report, trace=None):
+    """Records the spans of this process and its workers from now on.
+
+    The report, and the trace when given, are written at exit.
+    """
+    os.environ[ENV_REPORT] = str(Path(report).resolve())
+    os.environ[ENV_OWNER] = str(os.getpid())
+    if trace:
+        os.environ[ENV_TRACE] = str(Path(trace).resolve())
+    _start(os.environ[ENV_REPORT], os.environ.get(ENV_TRACE), os.getpid())
+
+
+def add_arguments(parser):
+    """Adds the --report and --trace options to a command line parser."""
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="Write a JSON report of the time spent per stage to this file.",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="Also write a Chrome trace (chrome://tracing) to this file.",
+    )
+
+
+def setup(args):
+    """Enables the instrumentation if asked by the options of `add_arguments`."""
+    report = args.report or (args.trace and args.trace.with_suffix(".report.json"))
+    if report:
+        enable(report, args.trace)
+
+
+# Workers started with spawn, or the scripts run with SLIDES_REPORT set
+if os.environ.get(ENV_REPORT):
+    os.environ.setdefault(ENV_OWNER, str(os.getpid()))
+    _start(
+        os.environ[ENV_REPORT], os.environ.get(ENV_TRACE), int(os.environ[ENV_OWNER])
+    )
@@ -0,0 +1,85 @@
+"""Local cache of LLM responses, stored in SQLite.
+
+Responses are addressed by a hash of the whole request (model, messages and
+sampling parameters), so the same prompt sent again costs no tokens. Entries
+expire after a TTL, and the least recently used ones are evicted when the
+cached responses exceed a size limit.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from disk_cache import CACHE_ROOT
+
+CACHE_FILE = CACHE_ROOT / "responses.sqlite"
+TTL = 30 * 24 * 3600
+MAX_CACHE_BYTES = 50 * 1024 * 1024
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, ttl=TTL, max_bytes=MAX_CACHE_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def key(request: dict) -> str:
+        """Hashes the arguments of a chat completion request."""
+        data = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Returns the cached response, or None if missing or expired."""
+        row = self.db.execute(
+            "SELECT response, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created = row
+        now = time.time()
+        if now - created > self.ttl:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.db.commit()
+            return None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self.db.commit()
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, response, len(response.encode("utf-8")), now, now),
+        )
+        self.evict(now)
+        self.db.commit()
+
+    def evict(self, now=None) -> None:
+        """Drops the expired entries and the oldest ones past max_bytes."""
+        now = now or time.time()
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM ("
+            "  SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS total"
+            "  FROM responses)"
+            " WHERE total > ?)",
+            (self.max_bytes,),
+        )
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,101 @@
+"""Routes of the LLM requests among the endpoints and models of config.ini.
+
+Besides [AI_SERVICE], the default route, config.ini can have [ROUTE name]
+sections with the keys of [AI_SERVICE] that change, and these routing keys:
+
+    max_prompt_tokens  prompts up to this size can use the route
+    fallback           route tried when this one fails, or is slow
+    hedge_after        seconds before the fallback gets the same request
+
+A prompt goes to the route with the smallest `max_prompt_tokens` that fits
+it, usually a fast and cheap model, and to [AI_SERVICE] when none does:
+
+    [ROUTE fast]
+    model_name = qwen-turbo
+    max_prompt_tokens = 8000
+    hedge_after = 30
+    fallback = backup
+
+    [ROUTE backup]
+    api_base = https://other-endpoint.com/v1
+    api_key = other_key
+
+[AI_SERVICE] can also have a fallback, and hedge_after, but its keys are
+not inherited by the routes.
+"""
+
+import configparser
+
+DEFAULT_ROUTE = "default"
+PREFIX = "ROUTE "
+ROUTING_KEYS = ("max_prompt_tokens", "fallback", "hedge_after")
+
+
+def route_names(config):
+    """Names of the [ROUTE name] sections."""
+    return [s[len(PREFIX) :].strip() for s in config.sections() if s.startswith(PREFIX)]
+
+
+def route_section(config, name):
+    if name == DEFAULT_ROUTE:
+        return config["AI_SERVICE"]
+    try:
+        return config[PREFIX + name]
+    except KeyError:
+        raise ValueError(f"Unknown route {name} in the config file") from None
+
+
+def route_config(config, name):
+    """Returns a config with the settings of the route as [AI_SERVICE].
+
+    The keys missing in the route are taken from [AI_SERVICE], so the
+    functions reading [AI_SERVICE] use the route. The name of the route is
+    kept as its `route` key.
+    """
+    service = {
+        key: value
+        for key, value in config["AI_SERVICE"].items()
+        if key not in ROUTING_KEYS
+    }
+    if name != DEFAULT_ROUTE:
+        service.update(route_section(config, name))
+    service["route"] = name
+    routed = configparser.ConfigParser(interpolation=None)
+    routed.read_dict({"AI_SERVICE": service})
+    return routed
+
+
+def select_route(config, tokens):
+    """The route with the smallest max_prompt_tokens that fits the prompt."""
+    fitting = []
+    for name in route_names(config):
+        limit = config[PREFIX + name].getint("max_prompt_tokens")
+        if limit is not None and tokens <= limit:
+            fitting.append((limit, name))
+    return min(fitting)[1] if fitting else DEFAULT_ROUTE
+
+
+def route_chain(config, name):
+    """The route followed by its fallbacks, in order, each one once."""
+    chain = []
+    while name and name not in chain:
+        chain.append(name)
+        name = route_section(config, name).get("fallback", "").strip()
+    return chain
+
+
+def hedge_after(config, name):
+    """Seconds before the fallback gets the request too, None to wait."""
+    return route_section(config, name).getfloat("hedge_after")
+
+
+def route_models(config):
+    """The model and prompt limit of each route, to key their outputs."""
+    return [
+        (
+            name,
+            route_config(config, name)["AI_SERVICE"]["model_name"],
+            config[PREFIX + name].get("max_prompt_tokens"),
+        )
+        for name in sorted(route_names(config))
+    ]
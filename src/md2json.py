@@ -2,9 +2,14 @@
 import pprint
 import re
 import argparse
-import markdown2  # fades
+import glob
+import sys
+from dataclasses import dataclass
 import json
+import os
+from pathlib import Path
 
+import instrument
 
 marks = dict(
     separator=["---"],
@@ -23,99 +28,290 @@ marks = dict(
 )
 
 
-def show(*args, **kwargs):
-    if VERBOSE:
-        pprint.pprint(*args, **kwargs)
+# A bullet, with its indentation: "-", "* ", "+ ", or the number of "1. " or "1) "
+BULLET = re.compile(r"^([ \t]*)(?:-[ \t]*|[*+][ \t]+|(\d+[.)])[ \t]+)")
+# Emphasis delimiters, "_" only out of words to keep snake_case names
+EMPHASIS = re.compile(r"\*+|(?<!\w)_+|_+(?!\w)")
 
 
-def processed_content(data: list) -> str:
-    html_content = markdown2.markdown(
-        "\n".join(x.replace("*", "").strip() for x in data if x.strip())
-    )
-    plain_text = re.sub("<[^>]+>", "", html_content)
-    return plain_text.replace("*", "")
+@dataclass
+class Run:
+    text: str
+    bold: bool = False
+    italic: bool = False
 
 
-def extract_data(md_file_path):
-    # Parse slides from Markdown
-    current_slide = {"title": [], "data": []}
-    count_backticks = 0
-    with open(md_file_path, "r", encoding="utf-8") as f:
-        for line in f.readlines():
-            line = line.strip()
-            if line.startswith("```"):
-                count_backticks += 1
-                continue
-            if count_backticks > 0 and count_backticks % 2 == 0:
-                continue
-            if line.startswith("*"):
-                line = line[1:].strip()
-            if line.startswith("("):
-                line = line[1:].strip()
-                if line.endswith(")"):
-                    line = line[:-1].strip()
-            if not line:
+def inline_runs(line):
+    """Splits a Markdown line in runs of bold, italic and plain text.
+
+    Returns the bullet level, None when the line is not a bullet, and the
+    runs. Each 2 spaces, or a tab, of indentation is a level, and numbered
+    items keep their number, as the slides do not number them. Delimiters
+    that are never closed, or have spaces on both sides, like the blanks of
+    an exercise, are kept as text.
+
+    >>> inline_runs("**Photosynthesis** makes food")
+    (None, [Run(text='Photosynthesis', bold=True, italic=False), \
+Run(text=' makes food', bold=False, italic=False)])
+    >>> inline_runs("    - *nested*")
+    (2, [Run(text='nested', bold=False, italic=True)])
+    >>> inline_runs("2) Mix them")
+    (0, [Run(text='2) Mix them', bold=False, italic=False)])
+    >>> inline_runs("I ___ to school every day.")
+    (None, [Run(text='I ___ to school every day.', bold=False, italic=False)])
+    >>> inline_runs("2 * 3 = 6, *not* 5")
+    (None, [Run(text='2 * 3 = 6, ', bold=False, italic=False), \
+Run(text='not', bold=False, italic=True), Run(text=' 5', bold=False, italic=False)])
+    """
+    level = None
+    bullet = BULLET.match(line)
+    if bullet:
+        indent = bullet.group(1).replace("\t", "  ")
+        level = len(indent) // 2
+        line = line[bullet.end() :]
+        if bullet.group(2):
+            line = f"{bullet.group(2)} {line}"
+    line = line.strip()
+
+    # Pairs each closing delimiter with the last opening one like it
+    pairs = []
+    opened = []
+    for delimiter in EMPHASIS.finditer(line):
+        if len(delimiter.group()) > 3:
+            continue
+        start, end = delimiter.span()
+        if start > 0 and not line[start - 1].isspace():
+            same = [d for d in opened if d.group() == delimiter.group()]
+            if same:
+                del opened[opened.index(same[-1]) :]
+                pairs.extend((same[-1], delimiter))
                 continue
-            elif line in marks["separator"] or "---" in line:
-                if current_slide:
-                    yield current_slide
-                current_slide = {"title": [], "data": []}
-            elif line.startswith("#"):
-                for i in range(len(line)):
-                    if line[i] != "#":
-                        break
-                title = line[i:].strip()
-                if "Slide" in title and ":" in title:
-                    title = title.split(":")[-1].strip()
-                if "Slide" in title and " – " in title:
-                    title = title.split(" – ")[-1].strip()
-                current_slide["title"].append(title)
-            elif current_slide is not None:
-                if line and line != "*":
-                    current_slide["data"].append(line)
-
-        if current_slide is not None:
-            yield current_slide
-
-
-def parse_markdown(md_file_path):
-    """Reads Markdown file and parses it."""
-
-    def add_to_section(section, line):
-        if section in sections:
-            if line.strip() and line.strip() != "*":
-                sections[section].append(line)
-
-    #  Process content and extract speaker notes and visual ideas
-    for slide in extract_data(md_file_path):
-        sections = dict(notes=[], content=[], visual=[], title=slide["title"])
-        section = "content"
-        for line in slide["data"]:
-            processed = False
+        if end < len(line) and not line[end].isspace():
+            opened.append(delimiter)
+
+    runs = []
+    bold = italic = False
+    position = 0
+    for delimiter in sorted(pairs, key=lambda d: d.start()):
+        runs.append(Run(line[position : delimiter.start()], bold, italic))
+        size = len(delimiter.group())
+        bold ^= size >= 2
+        italic ^= size != 2
+        position = delimiter.end()
+    runs.append(Run(line[position:], bold, italic))
+
+    # Joins the runs with the same format, and drops the empty ones
+    merged = []
+    for run in runs:
+        if not run.text:
+            continue
+        if merged and (merged[-1].bold, merged[-1].italic) == (run.bold, run.italic):
+            merged[-1].text += run.text
+        else:
+            merged.append(run)
+    return level, merged
+
+
+def read_lines(source):
+    """Yields the lines of a file path, or of any iterable of lines."""
+    if isinstance(source, (str, Path)):
+        with open(source, "r", encoding="utf-8") as f:
+            yield from f
+    else:
+        yield from source
+
+
+# Section of each tag, like "speaker notes" -> "notes"
+TAGS = {tag: section for section, tags in marks.items() for tag in tags}
+LINK = re.compile(r"\[[^>]+?\]")
+# Every section of a parsed slide is a list of strings
+SCHEMA = dict(notes=str, content=str, visual=str, title=str)
+
+
+def new_slide():
+    return dict(notes=[], content=[], visual=[], title=[])
+
+
+def finish_slide(sections, titles, data, verbose=False):
+    """Completes a slide when its separator, or the end, is read."""
+    # Headings come before the titles given with a "Title:" tag
+    sections["title"] = titles + sections["title"]
+    if not sections["title"]:
+        if sections["content"]:
+            sections["title"] = sections["content"][:1]
+            sections["content"] = sections["content"][1:]
+    sections["content"] = [LINK.sub("", x).rstrip() for x in sections["content"]]
+    if verbose:
+        pprint.pprint(sections)
+        pprint.pprint(data)
+        pprint.pprint("---")
+    return sections
+
+
+def parse_markdown(md_file_path, verbose=False):
+    """Parses the slides of a Markdown file, or of any iterable of lines.
+
+    Works in a single pass and yields each slide as soon as its separator is
+    read, so it can consume a stream of lines. With verbose, the parsed
+    slides are printed.
+    """
+    sections = new_slide()
+    section = "content"
+    titles = []
+    data = []
+    count_backticks = 0
+    for raw in read_lines(md_file_path):
+        line = raw.strip()
+        if line.startswith("```"):
+            count_backticks += 1
+            continue
+        if count_backticks > 0 and count_backticks % 2 == 0:
+            continue
+        # The indentation gives the level of the bullets
+        indent = raw[: len(raw) - len(raw.lstrip())]
+        if line.startswith("("):
+            line = line[1:].strip()
+            if line.endswith(")"):
+                line = line[:-1].strip()
+        if not line:
+            continue
+        elif "---" in line:
+            if titles or any(sections.values()):
+                yield finish_slide(sections, titles, data, verbose)
+            sections = new_slide()
+            section = "content"
+            titles = []
+            data = []
+        elif line[0] == "#":
+            title = line.lstrip("#").strip()
+            if "Slide" in title and ":" in title:
+                title = title.rsplit(":", 1)[-1].strip()
+            if "Slide" in title and " – " in title:
+                title = title.rsplit(" – ", 1)[-1].strip()
+            titles.append(title)
+        elif line != "*":
+            data.append(line)
+            # Process content and extract speaker notes and visual ideas
             line_ = line.lower().replace("*", "").strip()
             if ":" in line_:
-                tag = line_.split(":")[0]
-
-                for k in marks:
-                    if tag in marks[k]:
-                        if k in sections:
-                            section = k
-                            add_to_section(section, line.split(":")[-1].strip())
-                            processed = True
-                        break
-            if not processed:
-                add_to_section(section, line)
-        if not sections["title"]:
-            if sections["content"]:
-                sections["title"] = sections["content"][0]
-                sections["content"] = sections["content"][1:]
-        clean = re.sub("\[[^>]+?\]", "", "||".join(sections["content"]))
-        sections["content"] = [x.strip() for x in clean.split("||")]
-        show(sections)
-        show(slide.pop("data"))
-        show("---")
-
-        yield sections
+                tagged = TAGS.get(line_.split(":", 1)[0])
+                if tagged in sections:
+                    section = tagged
+                    tag, line = line.split(":", 1)
+                    # Drops the delimiters closing an emphasized tag, "**Notes:**"
+                    opened = BULLET.sub("", tag).count("*")
+                    line = line.strip()
+                    if opened and line.startswith("*" * opened):
+                        line = line[opened:]
+                    indent = ""
+            line = line.strip()
+            if line and line != "*":
+                sections[section].append(indent + line)
+
+    if titles or any(sections.values()):
+        yield finish_slide(sections, titles, data, verbose)
+
+
+def is_tag(line):
+    """Whether the line is only a section tag, like "**Speaker Notes**".
+
+    >>> is_tag("- **Speaker Notes**"), is_tag("Notes about the verbs")
+    (True, False)
+    """
+    return EMPHASIS.sub("", BULLET.sub("", line)).strip(" :").lower() in TAGS
+
+
+def validate_slide(slide):
+    """Returns the differences of the slide with SCHEMA, empty when valid.
+
+    Besides the types, a slide needs a title or some content, and a title or
+    content line that is only a tag is a tag the parser did not understand.
+    """
+    errors = []
+    for section, typ in SCHEMA.items():
+        if section not in slide:
+            errors.append(f"missing {section}")
+        elif not isinstance(slide[section], list):
+            errors.append(f"{section} is not a list")
+        elif not all(isinstance(item, typ) for item in slide[section]):
+            errors.append(f"{section} has items that are not {typ.__name__}")
+    errors.extend(f"unknown section {section}" for section in set(slide) - set(SCHEMA))
+    if errors:
+        return errors
+    if not slide["title"] and not slide["content"]:
+        errors.append("no title and no content")
+    for section in ("title", "content"):
+        errors.extend(
+            f"{section} is only a tag: {item}"
+            for item in slide[section]
+            if is_tag(item)
+        )
+    return errors
+
+
+def write_slides(slides, output_path):
+    """Writes and validates the slides in the same pass.
+
+    A .jsonl output gets one slide per line, anything else a JSON array.
+    The output only replaces the old one once every slide is read. Returns
+    the number of slides and the validation errors found.
+    """
+    count = 0
+    errors = []
+    jsonl = str(output_path).endswith(".jsonl")
+    tmp = Path(output_path).with_suffix(Path(output_path).suffix + ".tmp")
+    try:
+        with instrument.span("md_parse", output=str(output_path)) as span, open(
+            tmp, "w", encoding="utf-8"
+        ) as f:
+            if not jsonl:
+                f.write("[")
+            for count, slide in enumerate(slides, 1):
+                errors.extend(
+                    f"slide {count}: {error}" for error in validate_slide(slide)
+                )
+                if jsonl:
+                    f.write(json.dumps(slide, ensure_ascii=False) + "\n")
+                else:
+                    f.write("," if count > 1 else "")
+                    f.write("\n" + json.dumps(slide, indent=4, ensure_ascii=False))
+            if not jsonl:
+                f.write("\n]" if count else "]")
+            span.set(slides=count)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, output_path)
+    if not count:
+        errors.append("no slides")
+    return count, errors
+
+
+def convert_file(md_file_path, output_path):
+    """Converts a Markdown file, for the batch mode."""
+    return write_slides(parse_markdown(md_file_path), output_path)
+
+
+def convert_batch(md_files, output_dir=None, workers=None):
+    """Converts the Markdown files concurrently to JSON Lines.
+
+    Each output is named as its input with a .jsonl suffix, in output_dir or
+    next to the input. Yields the input, output and `convert_file` result,
+    or the error that stopped it.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for md_file in md_files:
+            md_file = Path(md_file)
+            output = Path(output_dir or md_file.parent) / (md_file.stem + ".jsonl")
+            futures[pool.submit(convert_file, md_file, output)] = md_file, output
+        for future in as_completed(futures):
+            try:
+                yield *futures[future], future.result()
+            except Exception as e:
+                yield *futures[future], e
 
 
 # Command-line interface setup
@@ -126,7 +322,8 @@ if __name__ == "__main__":
         "-i",
         type=str,
         default="presentation.md",
-        help="Path to the input Markdown file (default: presentation.md)",
+        help="Path to the input Markdown file, or - for stdin "
+        "(default: presentation.md)",
     )
     parser.add_argument(
         "--output",
@@ -144,11 +341,60 @@ if __name__ == "__main__":
         help="Prints the parsed slides (default: False)",
     )
 
-    # add a template argument
+    parser.add_argument(
+        "--batch",
+        "-b",
+        help="Convert all the files matching this pattern, like 'work/*.md', "
+        "to JSON Lines",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-d",
+        type=Path,
+        help="Folder of the JSON Lines files in batch mode "
+        "(default: next to each input)",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Number of worker processes in batch mode (default: one per CPU)",
+    )
+
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.setup(args)
 
-    global VERBOSE
-    VERBOSE = args.verbose
-    slides_data = [slide for slide in parse_markdown(args.input)]
-    with open(args.output, "w") as f:
-        json.dump(slides_data, f, indent=4)
+    failed = 0
+    if args.batch:
+        md_files = sorted(glob.glob(args.batch))
+        if not md_files:
+            sys.exit(f"No files matching {args.batch}")
+        if args.output_dir:
+            args.output_dir.mkdir(parents=True, exist_ok=True)
+        for md_file, output, result in convert_batch(
+            md_files, args.output_dir, args.workers
+        ):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{md_file}: {result}")
+                continue
+            count, errors = result
+            print(f"{md_file} -> {output}: {count} slides")
+            for error in errors:
+                print(f"  {error}")
+            failed += bool(errors)
+    else:
+        source = sys.stdin if args.input == "-" else args.input
+        try:
+            count, errors = write_slides(
+                parse_markdown(source, args.verbose), args.output
+            )
+        except (OSError, ValueError) as e:
+            sys.exit(f"{args.input}: {e}")
+        for error in errors:
+            print(error)
+        failed += bool(errors)
+    if failed:
+        sys.exit("Some files failed, or have slides that do not follow the schema")
@@ -0,0 +1,377 @@
+#!/usr/bin/fades
+"""Converts presentations to odp or pdf with warm headless office processes.
+
+Starting an office suite takes longer than converting a deck, so a
+`Converter` keeps some headless soffice processes running and sends them
+the files over the UNO socket, several at a time. A file that takes longer
+than the timeout, or that crashes its process, gets the process restarted.
+When the `uno` module of LibreOffice can not be imported, or the processes
+do not start, or all of them die, every file is converted with a one-shot
+`soffice --convert-to` instead.
+"""
+
+import argparse
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import instrument
+
+OFFICE = shutil.which("soffice") or shutil.which("libreoffice") or "libreoffice"
+# Export filter of each output format
+FILTERS = dict(odp="impress8", pdf="impress_pdf_Export")
+# Seconds allowed to convert a file, and to start a process
+TIMEOUT = 120.0
+START_TIMEOUT = 60.0
+
+
+def office_command(profile, *args):
+    """The soffice command line, with its own user profile.
+
+    Office processes sharing a profile block each other, so every process
+    gets a profile of its own.
+    """
+    return [
+        OFFICE,
+        f"-env:UserInstallation={Path(profile).as_uri()}",
+        "--headless",
+        "--invisible",
+        "--nologo",
+        "--norestore",
+        *args,
+    ]
+
+
+def convert_oneshot(source, outdir, fmt="odp", timeout=TIMEOUT):
+    """Converts the file starting an office process just for it."""
+    target = Path(outdir) / f"{Path(source).stem}.{fmt}"
+    with tempfile.TemporaryDirectory(prefix="office-") as profile:
+        subprocess.run(
+            office_command(profile, "--convert-to", fmt, str(source))
+            + ["--outdir", str(outdir)],
+            check=True,
+            capture_output=True,
+            timeout=timeout,
+        )
+    if not target.exists():
+        raise RuntimeError(f"{OFFICE} did not write {target}")
+    return target
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class OfficeProcess:
+    """A headless office process, and its UNO connection."""
+
+    def __init__(self, start_timeout=START_TIMEOUT):
+        self.start_timeout = start_timeout
+        self.process = None
+        self.desktop = None
+        self.profile = None
+
+    def start(self):
+        import uno  # LibreOffice python bridge, not in PyPI
+
+        self.profile = tempfile.mkdtemp(prefix="office-")
+        port = free_port()
+        self.process = subprocess.Popen(
+            office_command(
+                self.profile,
+                f"--accept=socket,host=127.0.0.1,port={port};urp;"
+                "StarOffice.ComponentContext",
+            ),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local
+        )
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:socket,host=127.0.0.1,port={port};urp;"
+                    "StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"{OFFICE} did not start")
+                time.sleep(0.2)
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass  # Already dead
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.profile is not None:
+            shutil.rmtree(self.profile, ignore_errors=True)
+            self.profile = None
+
+    def restart(self):
+        if self.process is not None:
+            self.process.kill()
+        self.stop()
+        self.start()
+
+    def _convert(self, source, target, fmt, result):
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def properties(**values):
+            props = []
+            for name, value in values.items():
+                prop = PropertyValue()
+                prop.Name, prop.Value = name, value
+                props.append(prop)
+            return tuple(props)
+
+        try:
+            document = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(str(Path(source).resolve())),
+                "_blank",
+                0,
+                properties(Hidden=True, ReadOnly=True),
+            )
+            try:
+                document.storeToURL(
+                    uno.systemPathToFileUrl(str(Path(target).resolve())),
+                    properties(FilterName=FILTERS[fmt], Overwrite=True),
+                )
+            finally:
+                document.close(True)
+        except Exception as e:
+            result.append(e)
+
+    def convert(self, source, target, fmt="odp", timeout=TIMEOUT):
+        """Converts the file, killing the process when it takes too long.
+
+        UNO calls can not be cancelled, so the conversion runs in a thread
+        and the process is killed to unblock it.
+        """
+        result = []
+        thread = threading.Thread(
+            target=self._convert, args=(source, target, fmt, result), daemon=True
+        )
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            if self.process is not None:
+                self.process.kill()
+            raise TimeoutError(f"{source} took more than {timeout:.0f}s")
+        if result:
+            raise result[0]
+        return target
+
+
+class Converter:
+    """Converts files with `workers` warm office processes.
+
+    Use it as a context manager, so the processes are stopped at the end.
+    `convert` can be called from many threads at the same time. A process
+    that can not be restarted is dropped, and once none is left the files
+    are converted with the one-shot CLI.
+    """
+
+    def __init__(self, workers=1, timeout=TIMEOUT, warm=True):
+        self.timeout = timeout
+        self.processes = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        if warm:
+            self.start(workers)
+
+    def start(self, workers):
+        """Starts the processes at the same time, keeping those that start."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def start(process):
+            try:
+                process.start()
+            except Exception:
+                # Without uno or soffice, the one-shot CLI is used
+                process.stop()
+                return None
+            return process
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for process in pool.map(start, [OfficeProcess() for _ in range(workers)]):
+                if process is not None:
+                    self.processes.append(process)
+                    self.idle.put(process)
+
+    @property
+    def warm(self):
+        return bool(self.processes)
+
+    def convert(self, source, outdir, fmt="odp"):
+        """Converts the file into outdir, and returns the converted file."""
+        with instrument.span("convert", source=str(source), warm=self.warm):
+            return self._convert(source, outdir, fmt)
+
+    def _convert(self, source, outdir, fmt):
+        if not self.warm:
+            return convert_oneshot(source, outdir, fmt, self.timeout)
+        target = Path(outdir) / f"{Path(source).stem}.{fmt}"
+        process = self.idle.get()
+        if process is None:
+            # The last process died, the next waiting thread is woken too
+            self.idle.put(None)
+            return convert_oneshot(source, outdir, fmt, self.timeout)
+        alive = True
+        try:
+            for attempt in range(2):
+                try:
+                    return process.convert(source, target, fmt, self.timeout)
+                except TimeoutError:
+                    alive = self.restart(process)
+                    raise
+                except Exception:
+                    # A crashed process is restarted and the file tried again
+                    alive = self.restart(process)
+                    if not alive or attempt:
+                        break
+        finally:
+            if alive:
+                self.idle.put(process)
+            else:
+                self.drop(process)
+        # The warm process can not convert it, the one-shot CLI may
+        return convert_oneshot(source, outdir, fmt, self.timeout)
+
+    def drop(self, process):
+        """Forgets a process that did not restart."""
+        process.stop()
+        with self.lock:
+            if process in self.processes:
+                self.processes.remove(process)
+            if not self.processes:
+                self.idle.put(None)
+
+    @staticmethod
+    def restart(process):
+        try:
+            process.restart()
+        except Exception:
+            return False
+        return True
+
+    def convert_many(self, sources, outdir, fmt="odp"):
+        """Converts the files concurrently.
+
+        Yields each file with its converted file, or the error that stopped
+        it, and the seconds spent on it, as they finish.
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        def timed(source):
+            start = time.perf_counter()
+            try:
+                result = self.convert(source, outdir, fmt)
+            except Exception as e:
+                result = e
+            return source, result, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.processes))) as pool:
+            for future in as_completed([pool.submit(timed, s) for s in sources]):
+                yield future.result()
+
+    def close(self):
+        for process in self.processes:
+            process.stop()
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts presentations with warm headless office processes."
+    )
+    parser.add_argument("files", nargs="+", type=Path, help="Files to convert.")
+    parser.add_argument(
+        "--outdir", "-o", type=Path, default=Path("."), help="Output folder."
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=list(FILTERS),
+        default="odp",
+        help="Output format (default: odp).",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=2,
+        help="Office processes converting at the same time (default: 2).",
+    )
+    parser.add_argument(
+        "--timeout",
+        "-t",
+        type=float,
+        default=TIMEOUT,
+        help=f"Seconds allowed to convert each file (default: {TIMEOUT:.0f}).",
+    )
+    parser.add_argument(
+        "--no-warm",
+        action="store_true",
+        help="Start an office process for each file, as the one-shot CLI.",
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    missing = [str(f) for f in args.files if not f.exists()]
+    if missing:
+        sys.exit(f"Files not found: {', '.join(missing)}")
+    args.outdir.mkdir(parents=True, exist_ok=True)
+
+    failed = 0
+    start = time.perf_counter()
+    with Converter(args.workers, args.timeout, not args.no_warm) as converter:
+        if not converter.warm:
+            print("Using the one-shot office CLI")
+        for source, result, seconds in converter.convert_many(
+            args.files, args.outdir, args.format
+        ):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{source}: failed, {result}")
+            else:
+                print(f"{result}: {seconds:.1f}s")
+    print(f"{len(args.files)} files in {time.perf_counter() - start:.1f}s")
+    if failed:
+        sys.exit(f"{failed} of {len(args.files)} files failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/fades
+"""Runs all the stages for a unit in a single process.
+
+VTT -> transcript -> slides markdown -> slides data -> pptx (-> odp).
+The data is passed in memory between the stages; the intermediate files of
+the per-stage scripts are only written when a debug directory is given.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import clean_vtt
+import create_slides_ia
+import instrument
+import md2json
+from create_w_template import build_presentation, output
+from office_convert import convert_oneshot
+
+
+def run_pipeline(
+    vtt_path,
+    unit_plan,
+    template_path,
+    output_path,
+    config,
+    templates,
+    debug_dir=None,
+    name="unit",
+    odp_dir=None,
+    cache=None,
+    refresh=False,
+    converter=None,
+):
+    """Creates the presentation of a unit from its VTT file and unit plan.
+
+    Returns the stats of the presentation plus the seconds spent per stage,
+    and the route of config.ini that generated the slides.
+    The odp conversion uses the warm processes of `converter`, an
+    `office_convert.Converter`, when given, and a one-shot office otherwise.
+    """
+    timings = {}
+    if debug_dir is not None:
+        Path(debug_dir).mkdir(parents=True, exist_ok=True)
+
+    def debug(suffix, content):
+        if debug_dir is not None:
+            create_slides_ia.write_file(Path(debug_dir) / f"{name}-{suffix}", content)
+
+    start = time.perf_counter()
+    with instrument.span("vtt_parse", input=str(vtt_path)):
+        transcription = "\n".join(clean_vtt.clean_transcript(Path(vtt_path)))
+    debug("transcript.txt", transcription)
+    timings["clean_vtt"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    transcription = create_slides_ia.condense_transcription(
+        transcription, unit_plan, templates, config, cache=cache, refresh=refresh
+    )
+    prompt = create_slides_ia.build_prompt(templates, unit_plan, transcription)
+    debug("prompt.txt", prompt)
+    markdown, route = create_slides_ia.route_chat_completion(
+        prompt, config, cache, refresh
+    )
+    debug("slides.md", markdown)
+    timings["create_slides"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with instrument.span("md_parse") as span:
+        slides_data = list(md2json.parse_markdown(markdown.splitlines()))
+        span.set(slides=len(slides_data))
+    debug("slides.json", json.dumps(slides_data, indent=4))
+    timings["md2json"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = build_presentation(str(template_path), slides_data, str(output_path))
+    stats["route"] = route
+    timings["create_w_template"] = time.perf_counter() - start
+
+    if odp_dir is not None:
+        start = time.perf_counter()
+        if converter is not None:
+            odp = converter.convert(output_path, odp_dir)
+        else:
+            with instrument.span("convert", source=str(output_path), warm=False):
+                odp = convert_oneshot(output_path, odp_dir)
+        stats["odp"] = str(odp)
+        timings["convert"] = time.perf_counter() - start
+
+    stats["timings"] = {stage: round(t, 3) for stage, t in timings.items()}
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Creates the presentation of a unit from its video transcription."
+    )
+    parser.add_argument(
+        "--input", "-i", type=Path, required=True, help="Path to the VTT file."
+    )
+    parser.add_argument(
+        "--unit_plan", "-u", type=Path, required=True, help="Path to the unit plan."
+    )
+    parser.add_argument(
+        "--template", "-t", type=Path, required=True, help="Path to the pptx template."
+    )
+    parser.add_argument(
+        "--output", "-o", type=Path, required=True, help="Path to the output pptx."
+    )
+    parser.add_argument(
+        "--odp", type=Path, help="Also convert the presentation to odp in this folder."
+    )
+    parser.add_argument(
+        "--debug-dir",
+        type=Path,
+        help="Write the intermediate transcript, prompt, markdown and json here.",
+    )
+    parser.add_argument(
+        "--name",
+        default="unit",
+        help="Prefix of the intermediate files, like u12 (default: unit).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the local cache of responses.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ask the model again and update the cached responses.",
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    for path in (args.input, args.unit_plan, args.template):
+        if not path.expanduser().exists():
+            sys.exit(f"Error: File not found at {path}")
+
+    config = create_slides_ia.initialize_config()
+    templates = create_slides_ia.check_prompt_templates()
+    cache = None if args.no_cache else create_slides_ia.ResponseCache()
+    try:
+        stats = run_pipeline(
+            args.input,
+            create_slides_ia.read_file(args.unit_plan),
+            args.template.expanduser().resolve(),
+            args.output,
+            config,
+            templates,
+            debug_dir=args.debug_dir,
+            name=args.name,
+            odp_dir=args.odp,
+            cache=cache,
+            refresh=args.refresh,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+    output(stats, f"Presentation saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
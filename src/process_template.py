@@ -2,28 +2,22 @@
 import pprint
 from dataclasses import dataclass
 from collections import defaultdict
+from functools import cached_property, lru_cache
+import random
 import sys
 from pathlib import Path
-import pptx  # fades python-pptx
-from rich.console import Console  # fades rich
-
-console = Console()
 
 
 def output(*args): ...
 
 
-# for arg in args:
-#     console.print(arg)
-#
-
-
 @dataclass
 class Placeholder:
     obj: object
     index: int
     space: int
     typ: str
+    key: int = None
 
     @classmethod
     def create(cls, obj, index):
@@ -33,6 +27,8 @@ class Placeholder:
         except AttributeError:
             new.space = 0
         new.typ = obj.placeholder_format.type.name.lower()
+        # The idx is kept by the placeholders of the slides using the layout
+        new.key = obj.placeholder_format.idx
         if new.typ in ["title", "center_title", "subtitle", "body", "content"]:
             if new.typ == "body":
                 new.typ = "content"
@@ -53,7 +49,51 @@ class Placeholder:
         return 0
 
     def __repr__(self):
-        return f"<PH> {self.typ}#{self.index} {self.obj.name}"
+        name = self.obj.name if self.obj is not None else ""
+        return f"<PH> {self.typ}#{self.index} {name}"
+
+    def to_record(self):
+        return dict(index=self.index, space=self.space, typ=self.typ, key=self.key)
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(obj=None, **record)
+
+
+def slide_fields(slide_data):
+    """Returns the populated fields of a slide that need a placeholder."""
+    return tuple(
+        k for k, v in slide_data.items() if len(v) and k not in ["notes", "visual"]
+    )
+
+
+@lru_cache(maxsize=None)
+def fit_types(types, fields):
+    """Fits the slide fields into a sequence of placeholder types.
+
+    Each field takes the best scored placeholder still free, in order.
+    Returns the total score (0 when a field is left out) and a tuple of
+    (field, position) pairs, where position points into `types`.
+    """
+    fitted = {}
+    matched = []
+    for orig in fields:
+        candidates = [
+            (pos, Placeholder.type_match(orig, typ))
+            for pos, typ in enumerate(types)
+            if pos not in fitted
+        ]
+        if candidates:
+            max_candidate = max(fit for _, fit in candidates)
+            for pos, fit in candidates:
+                if fit == max_candidate:
+                    matched.append((orig, pos))
+                    fitted[pos] = max_candidate
+                    break
+
+    if len(matched) < len(fields):
+        return 0, tuple(matched)
+    return sum(fitted.values()), tuple(matched)
 
 
 @dataclass
@@ -67,7 +107,7 @@ class Layout:
         s = f"<Layout> {self.name} {self.typ}#{self.position}\n"
         return s + pprint.pformat(self.placeholders)
 
-    @property
+    @cached_property
     def placeholders(self):
         phds = self.obj.placeholders
         places = {}
@@ -87,43 +127,88 @@ class Layout:
         name = slide.name.strip().lower()
         return Layout(name=name, typ="slide", position=0, obj=slide)
 
+    def to_record(self):
+        """Returns the analysis of the layout as plain data, without objects."""
+        return dict(
+            name=self.name,
+            typ=self.typ,
+            position=self.position,
+            placeholders=[ph.to_record() for ph in self.placeholders.values()],
+        )
+
+    @classmethod
+    def from_record(cls, record, prs=None):
+        """Rebuilds a layout from `to_record` data.
+
+        If the presentation is given, the layout object is taken from it.
+        """
+        obj = None
+        if prs is not None:
+            if record["typ"] == "slide_master":
+                obj = prs.slide_masters[record["position"]].slide_layouts[0]
+            else:
+                obj = prs.slide_layouts[record["position"]]
+        layout = cls(
+            name=record["name"], typ=record["typ"], position=record["position"], obj=obj
+        )
+        phs = (Placeholder.from_record(ph) for ph in record["placeholders"])
+        layout.placeholders = {ph.index: ph for ph in phs}
+        return layout
+
+    @cached_property
+    def signature(self):
+        """Placeholder types of the layout, in placeholder order."""
+        return tuple(ph.typ for ph in self.placeholders.values())
+
     def get_fitting(self, slide_data):
-        fit = 0
-        fitted = {}
-        matched_ph = {}
-        data = {}
-        for k, v in slide_data.items():
-            if len(v) and k not in ["notes", "visual"]:
-                data[k] = v
-
-        for orig in data.keys():
-            candidates = {}
-            pho = None
-            for idx, pho in self.placeholders.items():
-                if idx in fitted:
-                    continue
-                candidates[idx] = Placeholder.type_match(orig, pho.typ)
-            if candidates:
-                max_candidate = max(candidates.values())
-                for idx, fit in candidates.items():
-                    if fit == max_candidate:
-                        matched_ph[orig] = self.placeholders[idx]
-                        fitted[idx] = max_candidate
-                        break
-
-        for orig in data.keys():
-            if orig not in matched_ph:
-                return 0, matched_ph
-
-        return sum(fitted.values()), matched_ph
+        fit, matched = fit_types(self.signature, slide_fields(slide_data))
+        placeholders = list(self.placeholders.values())
+        return fit, {orig: placeholders[pos] for orig, pos in matched}
 
 
 class Layouts:
     def __init__(self, filename):
-        self.map = self.process_presentation(filename)
+        """Analyzes a template, given by filename or as an open Presentation.
+
+        When a Presentation is given its layouts are used as they are, so
+        they can be passed straight to `prs.slides.add_slide`.
+        """
+        self.set_map(self.process_presentation(filename))
+
+    def set_map(self, layouts):
+        self.map = layouts
+        self.index = self.build_index(self.map)
+        self._fitted = {}
+
+    @classmethod
+    def from_records(cls, records, prs=None):
+        """Rebuilds the analysis from `to_records` data, without parsing."""
+        new = cls.__new__(cls)
+        new.set_map([Layout.from_record(record, prs) for record in records])
+        return new
+
+    def to_records(self):
+        return [layout.to_record() for layout in self.map]
+
+    @staticmethod
+    def build_index(layouts):
+        """Groups the layouts by placeholder signature.
+
+        Layouts sharing a signature always get the same fitting score, so the
+        score is computed once per signature instead of once per layout.
+        """
+        index = defaultdict(list)
+        for layout in layouts:
+            index[layout.signature].append(layout)
+        return {sig: tuple(group) for sig, group in index.items()}
 
     def process_presentation(self, filename):
-        prs = pptx.Presentation(filename)
+        if isinstance(filename, (str, Path)):
+            import pptx  # fades python-pptx
+
+            prs = pptx.Presentation(filename)
+        else:
+            prs = filename
         map = []
         for idx, layout in enumerate(prs.slide_masters):
             obj = layout.slide_layouts[0]
@@ -137,33 +222,89 @@ class Layouts:
         return map
 
     def get_fitted_layouts(self, slide_data):
+        """Returns the best fitting layouts for the slide, in template order."""
+        fields = slide_fields(slide_data)
+        if fields not in self._fitted:
+            self._fitted[fields] = self.best_layouts(fields)
+        return list(self._fitted[fields])
+
+    def best_layouts(self, fields):
         fitting_map = defaultdict(list)
-        for layout in self.map:
-            fit, _ = layout.get_fitting(slide_data)
-            fitting_map[fit].append(layout)
-            output(f"=== {layout.name} {fit}", _)
-            output(layout)
+        for sig, group in self.index.items():
+            fit, _ = fit_types(sig, fields)
+            fitting_map[fit].extend(group)
+            output(f"=== {sig} {fit}", _)
         max_fit = max(fitting_map.keys())
-        return fitting_map[max_fit]
+        order = {id(layout): pos for pos, layout in enumerate(self.map)}
+        return tuple(sorted(fitting_map[max_fit], key=lambda x: order[id(x)]))
 
     def __str__(self):
         return pprint.pformat([str(i) for i in self.map])
 
 
+# Strategies to choose among the tied best layouts of a slide. They are
+# given the layouts in template order, and a new one is used per deck, so
+# the same slides always get the same layouts.
+class SeededRandom:
+    """Chooses at random, repeatable with the same seed."""
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def choose(self, layouts, slide_data):
+        return self.random.choice(layouts)
+
+
+class RoundRobin:
+    """Takes the layouts in turn, counting apart each set of slide fields."""
+
+    def __init__(self, seed=0):
+        self.turns = defaultdict(int)
+
+    def choose(self, layouts, slide_data):
+        fields = slide_fields(slide_data)
+        layout = layouts[self.turns[fields] % len(layouts)]
+        self.turns[fields] += 1
+        return layout
+
+
+class LeastRecentlyUsed:
+    """Takes the layout used longest ago, so the same one is not repeated."""
+
+    def __init__(self, seed=0):
+        self.used = {}
+        self.step = 0
+
+    def choose(self, layouts, slide_data):
+        layout = min(layouts, key=lambda x: self.used.get(id(x), -1))
+        self.used[id(layout)] = self.step
+        self.step += 1
+        return layout
+
+
+STRATEGIES = dict(random=SeededRandom, round_robin=RoundRobin, lru=LeastRecentlyUsed)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        sys.exit("Usage: process_template.py <template.pptx>")
+    import argparse
+
+    from template_cache import load_layouts
+
+    parser = argparse.ArgumentParser(
+        description="Shows the layouts of a template that fit a sample slide."
+    )
+    parser.add_argument("template", type=Path, help="Path to the pptx template.")
+    args = parser.parse_args()
 
-    fn = Path(sys.argv[1])
-    fn = fn.expanduser().resolve()
+    fn = args.template.expanduser().resolve()
     if not fn.exists():
         sys.exit(f"File not found: {fn}")
-    map = Layouts(fn)
+    map = load_layouts(fn)
 
     slide_data = dict(
         title=["title of the slide"], content=["content line", "content tow"]
     )
-    fit = map.get_layouts(slide_data)
+    fit = map.get_fitted_layouts(slide_data)
     pprint.pprint([str(i) for i in fit])
 
     pprint.pprint("l fin")
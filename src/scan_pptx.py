@@ -1,45 +1,120 @@
 #!/usr/bin/fades
 from pathlib import Path
 import argparse
-from process_template import Layouts  # fades python-pptx
-from rich.console import Console  # fades rich
+import json
+import os
+from disk_cache import CACHE_ROOT
+from template_cache import load_layouts  # fades python-pptx
 
-from rich.table import Table
-from functools import lru_cache
+INDEX_FILE = CACHE_ROOT / "scan_index.json"
 
 
 def log(*args):
+    from rich.console import Console  # fades rich
+
     Console().print(*args)
 
 
 # Your processing function — this is where you'd do something useful with each .pptx file
-@lru_cache
 def process_pptx_file(filepath):
-    layouts = Layouts(filepath)
-    stats = {" ".join(sorted(k)): len(v) for k, v in layouts.map.items()}
+    try:
+        # Scanned decks are read once, caching them would evict the templates
+        layouts = load_layouts(filepath, cache_dir=None)
+    except Exception as e:
+        return {"Filename": filepath.name, "Error": str(e) or type(e).__name__}
+    stats = {}
+    for layout in layouts.map:
+        key = " ".join(sorted(set(layout.signature))) or "none"
+        stats[key] = stats.get(key, 0) + 1
     stats["Total"] = len(layouts.map)
     stats["Filename"] = filepath.name
     return stats
 
 
-# Function to find all .pptx files and extract metadata
-def collect_pptx_metadata(start_path):
-    path = Path(start_path)
+def load_index(index_path):
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(index_path, index):
+    index_path = Path(index_path)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index_path.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+
+
+def file_signature(pptx_file):
+    stat = pptx_file.stat()
+    return dict(size=stat.st_size, mtime=stat.st_mtime_ns)
+
+
+# Function to find all .pptx files and yield their metadata as it is ready
+def iter_pptx_metadata(start_path, workers=None, index_path=INDEX_FILE, rescan=False):
+    """Yields the stats of every .pptx file under start_path.
+
+    Files whose path, size and mtime are in the index are not analyzed again
+    unless `rescan` is set, the rest are analyzed by a pool of `workers`
+    processes and yielded as they finish. Files that fail are not indexed,
+    so they are analyzed again next time. Use `index_path=None` to work
+    without an index.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    index = load_index(index_path) if index_path else {}
+    pending = {}
+    for pptx_file in Path(start_path).rglob("*.pptx"):
+        if not pptx_file.is_file():
+            continue
+        key = str(pptx_file.resolve())
+        signature = file_signature(pptx_file)
+        cached = index.get(key)
+        if (
+            not rescan
+            and cached
+            and "Error" not in cached["stats"]
+            and cached["size"] == signature["size"]
+            and cached["mtime"] == signature["mtime"]
+        ):
+            yield cached["stats"]
+        else:
+            pending[key] = (pptx_file, signature)
+
+    if not pending:
+        return
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(process_pptx_file, pptx_file): key
+                for key, (pptx_file, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                stats = future.result()
+                if "Error" not in stats:
+                    index[key] = dict(pending[key][1], stats=stats)
+                yield stats
+    finally:
+        if index_path:
+            save_index(index_path, index)
+
+
+def sort_headers(headers):
+    headers = sorted(headers - {"Filename", "Total"})
+    return ["Filename"] + headers + ["Total"]
+
+
+def collect_pptx_metadata(start_path, workers=None, index_path=INDEX_FILE):
     stats_lists = []
-
     headers = set()
-    for pptx_file in path.rglob("*.pptx"):
-        if pptx_file.is_file():
-            stats = process_pptx_file(pptx_file)
-            stats_lists.append(stats)
-            headers |= set(stats.keys())
-
-    headers = sorted(list(headers))
-    del headers[headers.index("Filename")]
-    del headers[headers.index("Total")]
-    headers.insert(0, "Filename")
-    headers.append("Total")
-    return stats_lists, headers
+    for stats in iter_pptx_metadata(start_path, workers, index_path):
+        stats_lists.append(stats)
+        headers |= set(stats.keys())
+    return stats_lists, sort_headers(headers)
 
 
 # Display metadata in a rich table
@@ -47,8 +122,8 @@ def display_metadata_table_(data, headers):
     log(headers, len(data))
 
 
-def display_metadata_table(data, headers):
-    console = Console()
+def build_metadata_table(data, headers):
+    from rich.table import Table  # fades rich
 
     table = Table(title="PowerPoint File Metadata", header_style="bold cyan")
     for header in headers:
@@ -69,8 +144,33 @@ def display_metadata_table(data, headers):
             table.add_row(*row, style="bold")
         else:
             table.add_row(*row, style="dim")
+    return table
+
+
+def display_metadata_table(data, headers):
+    from rich.console import Console  # fades rich
+
+    console = Console()
+    console.print(build_metadata_table(data, headers))
 
-    console.print(table)
+
+def display_metadata_live(
+    start_path, workers=None, index_path=INDEX_FILE, rescan=False
+):
+    """Shows the table while the files are scanned, one row per finished file."""
+    from rich.console import Console  # fades rich
+    from rich.live import Live
+
+    data = []
+    headers = set()
+
+    def render():
+        return build_metadata_table(data, sort_headers(headers | {"Filename", "Total"}))
+
+    with Live(get_renderable=render, console=Console()):
+        for stats in iter_pptx_metadata(start_path, workers, index_path, rescan):
+            data.append(stats)
+            headers.update(stats.keys())
 
 
 if __name__ == "__main__":
@@ -83,7 +183,24 @@ if __name__ == "__main__":
         default=".",
         help="Directory to search for .pptx files (default: current directory)",
     )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--index",
+        type=Path,
+        default=INDEX_FILE,
+        help=f"Results index used to skip unchanged files (default: {INDEX_FILE})",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="Analyze every file again, ignoring the results index",
+    )
     args = parser.parse_args()
 
-    stats_list, headers = collect_pptx_metadata(args.path)
-    display_metadata_table(stats_list, headers)
+    display_metadata_live(args.path, args.workers, args.index, args.rescan)
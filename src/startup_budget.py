@@ -0,0 +1,122 @@
+#!/usr/bin/fades
+"""Checks the startup time of the command line scripts against a budget.
+
+Each script is run with `--help` under `python -X importtime`, and the time
+spent importing modules, without the interpreter's own `site`, is compared
+with its budget. The batch runs launch these scripts hundreds of times, so
+heavy modules must be imported where they are used, not at the top.
+"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent
+# Milliseconds of imports allowed to each entry point. They leave room for
+# the noise of the machine, but not for openai (~400 ms), python-pptx
+# (~100 ms), rich or asyncio (~40 ms each) imported at the top.
+BUDGETS = dict(
+    build=150,
+    clean_vtt=60,
+    create_slides_ia=100,
+    create_w_template=100,
+    md2json=60,
+    office_convert=60,
+    pipeline=150,
+    process_template=60,
+    scan_pptx=100,
+)
+
+
+def import_times(script):
+    """Runs the script with --help, and returns its imports with their times.
+
+    The times are the cumulative microseconds of the top level imports, as
+    reported by -X importtime. The script runs in an empty folder, and
+    RuntimeError is raised when it fails or writes files there, as then it
+    did more than showing its help.
+    """
+    with tempfile.TemporaryDirectory(prefix="startup-") as cwd:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                str(SRC_DIR / f"{script}.py"),
+                "--help",
+            ],
+            capture_output=True,
+            text=True,
+            cwd=cwd,
+        )
+        written = sorted(p.name for p in Path(cwd).iterdir())
+    if result.returncode:
+        raise RuntimeError(f"--help exited with {result.returncode}")
+    if written:
+        raise RuntimeError(f"--help wrote {', '.join(written)}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue  # nested import, or the header
+        name = name.strip()
+        if name != "site":
+            times[name] = times.get(name, 0) + int(cumulative)
+    return times
+
+
+def measure(script, repeat):
+    """Returns the smallest total of `repeat` runs, and the imports of that run."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(script)
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+    return sum(best.values()) / 1000, best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks the import time of the scripts against their budget."
+    )
+    parser.add_argument(
+        "scripts", nargs="*", help="Scripts to check (default: all of them)."
+    )
+    parser.add_argument(
+        "--repeat", "-r", type=int, default=5, help="Runs per script (default: 5)."
+    )
+    parser.add_argument(
+        "--top", "-t", type=int, default=0, help="Show the slowest imports."
+    )
+    args = parser.parse_args()
+
+    scripts = args.scripts or list(BUDGETS)
+    unknown = set(scripts) - set(BUDGETS)
+    if unknown:
+        sys.exit(f"Scripts without budget: {', '.join(sorted(unknown))}")
+
+    over = []
+    for script in scripts:
+        try:
+            total, times = measure(script, args.repeat)
+        except RuntimeError as e:
+            print(f"{script:20} failed, {e}")
+            over.append(script)
+            continue
+        budget = BUDGETS[script]
+        status = "ok" if total <= budget else "OVER"
+        print(f"{script:20} {total:7.1f} ms  budget {budget:4d} ms  {status}")
+        for name, micros in sorted(times.items(), key=lambda x: -x[1])[: args.top]:
+            print(f"    {name:30} {micros / 1000:7.1f} ms")
+        if total > budget:
+            over.append(script)
+    if over:
+        sys.exit(f"Over budget or failed: {', '.join(over)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""On disk cache of the template analysis made by `process_template.Layouts`.
+
+Entries are keyed by the content hash and modification time of the template,
+so an edited template is analyzed again. The cache directory is kept under a
+size limit by removing the least recently used entries.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from disk_cache import CACHE_ROOT, evict, file_hash, touch
+from process_template import Layouts
+
+CACHE_DIR = CACHE_ROOT / "templates"
+MAX_CACHE_BYTES = 20 * 1024 * 1024
+# Bump when the records written by Layouts.to_records change
+CACHE_VERSION = 1
+
+
+def template_key(path: Path) -> str:
+    """Hashes the template content, plus its modification time."""
+    return f"{file_hash(path)}-{path.stat().st_mtime_ns}"
+
+
+def read_entry(entry: Path):
+    try:
+        with entry.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != CACHE_VERSION:
+        return None
+    touch(entry)
+    return data["layouts"]
+
+
+def write_entry(entry: Path, records, max_bytes: int) -> None:
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(dict(version=CACHE_VERSION, layouts=records), f)
+    os.replace(tmp, entry)
+    evict(entry.parent, max_bytes)
+
+
+def load_layouts(filename, prs=None, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Returns the Layouts of a template, using the cache when possible.
+
+    If the template is already open, pass it as `prs` so the layouts are bound
+    to its objects. Use `cache_dir=None` to skip the cache.
+    """
+    if cache_dir is None:
+        return Layouts(prs if prs is not None else filename)
+
+    path = Path(filename)
+    entry = Path(cache_dir) / f"{template_key(path)}.json"
+    records = read_entry(entry) if entry.exists() else None
+    if records is not None:
+        return Layouts.from_records(records, prs)
+
+    layouts = Layouts(prs if prs is not None else path)
+    try:
+        write_entry(entry, layouts.to_records(), max_bytes)
+    except OSError:
+        pass  # The template is analyzed again next time
+    return layouts
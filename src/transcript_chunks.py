@@ -0,0 +1,126 @@
+"""Token aware splitting of transcripts into overlapping chunks.
+
+Tokens are counted with tiktoken when it is installed, otherwise they are
+estimated from the length of the text. tiktoken is only imported when the
+first tokens are counted, as the scripts importing this module start faster
+without it.
+"""
+
+import re
+from typing import Iterable, List
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Rough average for English text with the usual BPE tokenizers
+CHARS_PER_TOKEN = 4
+
+# The tiktoken encoding once loaded, False when tiktoken is not installed
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken  # fades
+        except ImportError:
+            _encoding = False
+        else:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Counts, or estimates, the number of tokens of the text."""
+    encoding = get_encoding()
+    if not encoding:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_sentences(lines: Iterable[str]) -> List[str]:
+    """Splits the transcript lines into sentences.
+
+    Auto generated captions usually lack punctuation, in that case each
+    caption line is taken as a sentence.
+    """
+    text = " ".join(line.strip() for line in lines if line.strip())
+    sentences = [s for s in SENTENCE_END.split(text) if s]
+    if len(sentences) <= 1:
+        return [line.strip() for line in lines if line.strip()]
+    return sentences
+
+
+def word_tokens(word: str) -> float:
+    """Tokens a word adds to a text, with the space before it."""
+    if not get_encoding():
+        return (len(word) + 1) / CHARS_PER_TOKEN
+    return count_tokens(" " + word)
+
+
+def split_words(sentence: str, max_tokens: int) -> List[str]:
+    """Splits a sentence longer than max_tokens at word boundaries.
+
+    Each word is counted once, and the part is only counted as a whole near
+    max_tokens, where the sum of the words may be off by a token.
+    """
+    parts = []
+    current = []
+    size = 0
+    for word in sentence.split():
+        tokens = word_tokens(word)
+        if current and size + tokens > max_tokens - 1:
+            exact = count_tokens(" ".join(current + [word]))
+            if exact > max_tokens:
+                parts.append(" ".join(current))
+                current = []
+                size = 0
+            else:
+                size = exact - tokens
+        current.append(word)
+        size += tokens
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+
+def chunk_transcript(
+    lines: Iterable[str], max_tokens: int, overlap_tokens: int = 0
+) -> List[str]:
+    """Groups the transcript sentences into chunks of at most max_tokens.
+
+    Each chunk starts with the last sentences of the previous one, up to
+    overlap_tokens, so no idea is cut without context.
+    """
+    sentences = []
+    for sentence in split_sentences(list(lines)):
+        tokens = count_tokens(sentence)
+        if tokens > max_tokens:
+            sentences.extend(
+                (s, count_tokens(s)) for s in split_words(sentence, max_tokens)
+            )
+        else:
+            sentences.append((sentence, tokens))
+
+    chunks = []
+    current = []
+    size = 0
+    for sentence, tokens in sentences:
+        if current and size + tokens > max_tokens:
+            chunks.append(" ".join(s for s, _ in current))
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + previous[1] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous[1]
+            # Keep room for the new sentence
+            while overlap and overlap_size + tokens > max_tokens:
+                overlap_size -= overlap.pop(0)[1]
+            current = overlap
+            size = overlap_size
+        current.append((sentence, tokens))
+        size += tokens
+    if current:
+        chunks.append(" ".join(s for s, _ in current))
+    return chunks